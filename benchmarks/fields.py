@@ -0,0 +1,61 @@
+"""Compare building serializer fields per instance with copying them from the
+field map built once per serializer class.
+
+Run with:
+
+    python -m benchmarks.fields
+"""
+import os
+import timeit
+
+
+def main(repeat=5, number=2000):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    import django
+    django.setup()
+
+    from rest_framework import serializers
+    from rest_framework.test import APIRequestFactory
+
+    from rest_framework_extras.serializers import HyperlinkedModelSerializer
+    from rest_framework_extras.tests import models
+
+    request = APIRequestFactory().get("/tests-vanilla/")
+
+    def get_fields(self):
+        # Inspect the model for every instance, the way DRF does
+        return serializers.ModelSerializer.get_fields(self)
+
+    klasses = (
+        ("drf", type(
+            str("UncachedSerializer"),
+            (HyperlinkedModelSerializer,),
+            {"model": models.Vanilla, "get_fields": get_fields}
+        )),
+        ("cached", type(
+            str("CachedSerializer"),
+            (HyperlinkedModelSerializer,),
+            {"model": models.Vanilla}
+        )),
+    )
+
+    def instance(klass):
+        def build():
+            klass(context={"request": request}).fields
+        return build
+
+    results = []
+    for name, klass in klasses:
+        # Warm up so the cached class has its field map
+        instance(klass)()
+        best = min(timeit.repeat(instance(klass), repeat=repeat, number=number))
+        results.append((name, best / number))
+
+    print("fields for one %s serializer" % models.Vanilla.__name__)
+    for name, seconds in results:
+        print("%-8s %8.1f us per instance" % (name, seconds * 1000000))
+    print("speedup  %8.1fx" % (results[0][1] / results[1][1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Compare DRF's hyperlink fields with the cached URL template fields.
+
+Run with:
+
+    python -m benchmarks.hyperlinks
+"""
+import os
+import timeit
+
+
+def main(rows=100, relations=3, repeat=5, number=20):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    import django
+    django.setup()
+
+    from rest_framework import relations as drf_relations
+    from rest_framework.test import APIRequestFactory
+
+    from rest_framework_extras import reverse
+    from rest_framework_extras.serializers import HyperlinkedRelatedField
+
+    request = APIRequestFactory().get("/tests-vanilla/")
+    values = [drf_relations.PKOnlyObject(pk=pk) for pk in range(1, rows + 1)]
+
+    def page(klass):
+        def render():
+            # Fresh fields per page, the way a serializer instance gets them
+            fields = []
+            for i in range(relations):
+                field = klass(view_name="foo-detail", read_only=True)
+                field._context = {"request": request}
+                fields.append(field)
+            for value in values:
+                for field in fields:
+                    field.to_representation(value)
+        return render
+
+    results = []
+    for name, klass in (
+        ("drf", drf_relations.HyperlinkedRelatedField),
+        ("cached", HyperlinkedRelatedField),
+    ):
+        reverse.clear_url_templates()
+        best = min(timeit.repeat(page(klass), repeat=repeat, number=number))
+        results.append((name, best / number))
+
+    print("%d rows x %d relations per page" % (rows, relations))
+    for name, seconds in results:
+        print("%-8s %8.3f ms per page" % (name, seconds * 1000))
+    print("speedup  %8.1fx" % (results[0][1] / results[1][1]))
+
+
+if __name__ == "__main__":
+    main()
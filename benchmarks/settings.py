@@ -0,0 +1,19 @@
+import os
+
+from project.settings import *
+
+
+# Benchmarks run against their own database and URL configuration. Set
+# DRFE_BENCHMARK_DB to a path to keep seeded rows between runs.
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.environ.get("DRFE_BENCHMARK_DB", ":memory:"),
+    }
+}
+
+ROOT_URLCONF = "benchmarks.urls"
+
+DEBUG = False
+
+ALLOWED_HOSTS = ["testserver"]
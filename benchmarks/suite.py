@@ -0,0 +1,314 @@
+"""Benchmark the generated endpoints against SQLite.
+
+Vanilla, WithForm and WithTrickyForm are seeded with rows objects each. Every
+Foo is the foreign key of foreign_fanout objects and every object links to
+many_fanout Bars. List, detail, create and PATCH requests and discover() are
+then measured. WithTrickyForm rejects every create, so it gets an
+invalid-create scenario and no PATCH. Latency percentiles, queries per
+request and peak memory are written as JSON. Given a baseline the run fails
+when a result regresses by more than tolerance, or runs more queries.
+
+Run with:
+
+    python -m benchmarks.suite --rows 1000 --output baseline.json
+    python -m benchmarks.suite --rows 1000 --baseline baseline.json
+
+Seeding a million rows takes a while. Set DRFE_BENCHMARK_DB to a path to keep
+the rows between runs.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+
+# Route names and model class names of the measured models
+MODELS = (
+    ("vanilla", "Vanilla"),
+    ("withform", "WithForm"),
+    ("withtrickyform", "WithTrickyForm"),
+)
+
+# Metrics compared against the baseline, relative to tolerance. p99 is
+# reported but too noisy to compare.
+TIMED_METRICS = ("p50", "p90", "peak_memory")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[int(round((len(values) - 1) * p / 100.0))]
+
+
+def seed(rows, foreign_fanout, many_fanout, batch_size=10000):
+    """Create the objects unless a kept database already has them"""
+
+    from django.contrib.auth import get_user_model
+    from django.db import transaction
+
+    from rest_framework_extras.tests import models
+
+    user_model = get_user_model()
+    if not user_model.objects.filter(username="benchmark").exists():
+        user_model.objects.create(
+            username="benchmark", is_staff=True, is_superuser=True
+        )
+
+    foos = max(1, rows // max(1, foreign_fanout))
+    bars = max(1, many_fanout) * 10
+    for model, count in ((models.Foo, foos), (models.Bar, bars)):
+        missing = count - model.objects.count()
+        if missing > 0:
+            # SQLite limits the rows of an insert without columns
+            model.objects.bulk_create(
+                [model() for i in range(missing)], batch_size=500
+            )
+    foo_pks = list(models.Foo.objects.values_list("pk", flat=True)[:foos])
+    bar_pks = list(models.Bar.objects.values_list("pk", flat=True)[:bars])
+
+    for name, klass in MODELS:
+        model = getattr(models, klass)
+        existing = model.objects.count()
+        if existing >= rows:
+            continue
+        field = model._meta.get_field("many_field")
+        through = field.remote_field.through
+        source = "%s_id" % field.m2m_field_name()
+        target = "%s_id" % field.m2m_reverse_field_name()
+        start = (model.objects.order_by("-pk").values_list(
+            "pk", flat=True
+        ).first() or 0) + 1
+
+        for offset in range(0, rows - existing, batch_size):
+            pks = range(
+                start + offset,
+                start + min(offset + batch_size, rows - existing)
+            )
+            with transaction.atomic():
+                model.objects.bulk_create([
+                    model(
+                        pk=pk,
+                        editable_field="editable_field_%s" % pk,
+                        another_editable_field="another_editable_field",
+                        foreign_field_id=foo_pks[pk % len(foo_pks)]
+                    ) for pk in pks
+                ])
+                through.objects.bulk_create([
+                    through(**{
+                        source: pk,
+                        target: bar_pks[(pk + i) % len(bar_pks)]
+                    }) for pk in pks for i in range(many_fanout)
+                ])
+
+
+def measure(func, requests):
+    """Call func requests times and return latency percentiles, the queries
+    of one more call and the peak memory of another."""
+
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    # Warm up caches the way a running process has them
+    func(0)
+
+    latencies = []
+    for i in range(requests):
+        start = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - start)
+
+    with CaptureQueriesContext(connection) as context:
+        func(requests)
+    queries = len(context.captured_queries)
+
+    tracemalloc.start()
+    try:
+        func(requests + 1)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "p50": percentile(latencies, 50),
+        "p90": percentile(latencies, 90),
+        "p99": percentile(latencies, 99),
+        "queries": queries,
+        "peak_memory": peak,
+    }
+
+
+def get_scenarios(client):
+    """Return a list of (name, func) where func takes the iteration"""
+
+    from rest_framework import routers
+
+    from rest_framework_extras import discover
+    from rest_framework_extras.tests import models
+
+    foo = "http://testserver/tests-foo/%s/" % models.Foo.objects.first().pk
+    bar = "http://testserver/tests-bar/%s/" % models.Bar.objects.first().pk
+
+    def request(method, path, expected, data=None):
+        response = getattr(client, method)(path, data, format="json")
+        if response.status_code != expected:
+            raise RuntimeError("%s %s returned %s: %s" % (
+                method.upper(), path, response.status_code,
+                response.content[:200]
+            ))
+        return response
+
+    scenarios = []
+    for name, klass in MODELS:
+        path = "/tests-%s/" % name
+        model = getattr(models, klass)
+        pks = list(model.objects.values_list("pk", flat=True)[:100])
+
+        def create_data(i):
+            return {
+                "editable_field": "created_%s" % i,
+                "another_editable_field": "another_editable_field",
+                "foreign_field": foo,
+                "many_field": [bar],
+            }
+
+        scenarios.extend([
+            ("%s-list" % name, lambda i, path=path:
+                request("get", path, 200)),
+            ("%s-detail" % name, lambda i, path=path, pks=pks:
+                request("get", "%s%s/" % (path, pks[i % len(pks)]), 200)),
+        ])
+
+        # The tricky form requires a field the serializer can't provide, so
+        # its create is always rejected. It measures validation and is named
+        # so it isn't read as a create.
+        if name == "withtrickyform":
+            scenarios.append(("%s-invalid-create" % name, lambda i, path=path:
+                request("post", path, 400, create_data(i))))
+            continue
+
+        scenarios.extend([
+            ("%s-create" % name, lambda i, path=path:
+                request("post", path, 201, create_data(i))),
+            ("%s-patch" % name, lambda i, path=path, pks=pks:
+                request(
+                    "patch", "%s%s/" % (path, pks[i % len(pks)]), 200,
+                    {"another_editable_field": "patched_%s" % i}
+                )),
+        ])
+
+    for backend in ("apps", "contenttypes"):
+        scenarios.append(("discover-%s" % backend, lambda i, backend=backend:
+            discover(routers.SimpleRouter(), backend=backend)))
+    return scenarios
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions of results against baseline"""
+
+    if results["parameters"] != baseline["parameters"]:
+        return ["baseline was recorded with parameters %s" % json.dumps(
+            baseline["parameters"], sort_keys=True
+        )]
+
+    failures = []
+    for name, expected in sorted(baseline["results"].items()):
+        actual = results["results"].get(name, None)
+        if actual is None:
+            failures.append("%s was not measured" % name)
+            continue
+        for key in TIMED_METRICS:
+            if actual[key] > expected[key] * (1 + tolerance):
+                failures.append("%s %s is %s, baseline %s" % (
+                    name, key, actual[key], expected[key]
+                ))
+        if actual["queries"] > expected["queries"]:
+            failures.append("%s runs %s queries, baseline %s" % (
+                name, actual["queries"], expected["queries"]
+            ))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rows", type=int, default=1000,
+        help="objects per model, eg. 1000 to 1000000")
+    parser.add_argument("--foreign-fanout", type=int, default=10,
+        help="objects per foreign key target")
+    parser.add_argument("--many-fanout", type=int, default=3,
+        help="many to many links per object")
+    parser.add_argument("--requests", type=int, default=50,
+        help="timed requests per scenario")
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare with this results file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+        help="allowed relative increase of latency and memory")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    import django
+    django.setup()
+
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+
+    from rest_framework.test import APIClient
+
+    call_command("migrate", run_syncdb=True, verbosity=0)
+    start = time.perf_counter()
+    seed(args.rows, args.foreign_fanout, args.many_fanout)
+    seeding = time.perf_counter() - start
+
+    client = APIClient()
+    client.force_authenticate(
+        get_user_model().objects.get(username="benchmark")
+    )
+
+    results = {
+        "parameters": {
+            "rows": args.rows,
+            "foreign_fanout": args.foreign_fanout,
+            "many_fanout": args.many_fanout,
+            "requests": args.requests,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "platform": platform.platform(),
+        },
+        "seconds_seeding": seeding,
+        "results": {},
+    }
+
+    print("%-24s %9s %9s %9s %8s %10s" % (
+        "scenario", "p50 ms", "p90 ms", "p99 ms", "queries", "peak KiB"
+    ))
+    for name, func in get_scenarios(client):
+        result = measure(func, args.requests)
+        results["results"][name] = result
+        print("%-24s %9.2f %9.2f %9.2f %8d %10.1f" % (
+            name, result["p50"] * 1000, result["p90"] * 1000,
+            result["p99"] * 1000, result["queries"],
+            result["peak_memory"] / 1024.0
+        ))
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=4, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        failures = compare(results, baseline, args.tolerance)
+        if failures:
+            sys.stderr.write("REGRESSIONS against %s:\n" % args.baseline)
+            for failure in failures:
+                sys.stderr.write("  %s\n" % failure)
+            return 1
+        print("No regressions against %s" % args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,27 @@
+from django.conf.urls import include, url
+
+from rest_framework import routers
+
+from rest_framework_extras import discover
+from rest_framework_extras.tests import forms
+
+
+router = routers.SimpleRouter()
+
+# The apps backend needs no database, which is created after this module is
+# imported
+discover(
+    router,
+    only=[
+        "tests.bar",
+        "tests.foo",
+        "tests.vanilla",
+        ("tests.withform", {"form": forms.WithFormForm}),
+        ("tests.withtrickyform", {"form": forms.WithFormTrickyForm}),
+    ],
+    backend="apps"
+)
+
+urlpatterns = [
+    url(r"^", include(router.urls)),
+]
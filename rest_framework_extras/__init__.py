@@ -1,15 +1,29 @@
+import hashlib
+import json
 import logging
+import os
 import re
+import tempfile
 from collections import OrderedDict
+from functools import partial
 
+import django
 from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
 from django.db.utils import OperationalError, ProgrammingError
 
-from rest_framework.permissions import DjangoModelPermissions
-
+from rest_framework_extras.instrumentation import timed
+from rest_framework_extras.pagination import KeysetPagination
+from rest_framework_extras.permissions import DjangoModelPermissions
+from rest_framework_extras.querysets import get_related_lookups
+from rest_framework_extras.reverse import clear_url_templates
 from rest_framework_extras.serializers import HyperlinkedModelSerializer
 
 
+# Django 3.2 finds the app config by itself
+if django.VERSION < (3, 2):
+    default_app_config = "rest_framework_extras.apps.RestFrameworkExtrasConfig"
+
 logger = logging.getLogger("django")
 
 
@@ -26,23 +40,221 @@ def get_settings():
             "admin-logentry": {},
         },
         "authentication-classes": (SessionAuthentication, BasicAuthentication),
-        "permission-classes": (DjangoModelPermissions,)
+        "permission-classes": (DjangoModelPermissions,),
+        "pagination-class": KeysetPagination,
+        "timestamp-field": "updated"
     })
 
 
-def discover(router, override=None, only=None, exclude=None):
-    """Generate default serializers and viewsets. This function should be run
-    before doing normal registration through the router."""
+def _get_timestamp_field(model, name):
+    """Return name if model has a concrete DateTimeField called name"""
+
+    # Import late because apps may not be loaded yet
+    from django.db.models import DateTimeField
+
+    if not name:
+        return None
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+    if not field.concrete or not isinstance(field, DateTimeField):
+        return None
+    return field.name
+
+
+def _build_viewset(model, prefix, options, SETTINGS):
+    """Generate a serializer and a viewset class for model."""
+
+    # Import late because apps may not be loaded yet
+    from rest_framework_extras import cache, renderers
+    from rest_framework_extras.asynchronous import AsyncMixin
+    from rest_framework_extras.viewsets import CacheMixin, \
+        ConditionalMixin, ModelViewSet
+
+    serializer_klass = type(
+        str("%sSerializer" % prefix),
+        (HyperlinkedModelSerializer,),
+        {
+            "model": model,
+            "form": options.get("form", None),
+            "admin": options.get("admin", None),
+            "admin_site": options.get("admin_site", None)
+        }
+    )
+
+    # Explicit lookups in override take precedence over the ones derived from
+    # the serializer.
+    select_related = options.get("select_related", None)
+    prefetch_related = options.get("prefetch_related", None)
+    if (select_related is None) or (prefetch_related is None):
+        auto_select, auto_prefetch = get_related_lookups(
+            model, serializer_klass
+        )
+        if select_related is None:
+            select_related = auto_select
+        if prefetch_related is None:
+            prefetch_related = auto_prefetch
+
+    attrs = {
+        "serializer_class": serializer_klass,
+        "queryset": model.objects.all(),
+        "select_related": tuple(select_related),
+        "prefetch_related": tuple(prefetch_related),
+        "authentication_classes": SETTINGS["authentication-classes"],
+        "permission_classes": SETTINGS["permission-classes"]
+    }
+
+    # Renderers whose optional package is missing are skipped
+    renderer_classes = SETTINGS.get("renderer-classes", None)
+    if renderer_classes is not None:
+        attrs["renderer_classes"] = renderers.get_available(renderer_classes)
+
+    # Keyset pagination unless disabled. The ordering field must be indexed
+    # for deep pages to stay cheap. Streamed lists are never paginated.
+    pagination_klass = options.get(
+        "pagination_class",
+        SETTINGS.get("pagination-class", KeysetPagination)
+    )
+    if options.get("streaming", False):
+        attrs["streaming"] = True
+        attrs["pagination_class"] = None
+        if "chunk_size" in options:
+            attrs["chunk_size"] = options["chunk_size"]
+    elif pagination_klass is not None:
+        pagination_attrs = {}
+        if "ordering" in options:
+            pagination_attrs["ordering"] = options["ordering"]
+        if "count" in options:
+            pagination_attrs["include_count"] = options["count"]
+        if pagination_attrs:
+            pagination_klass = type(
+                str("%sPagination" % prefix),
+                (pagination_klass,),
+                pagination_attrs
+            )
+        attrs["pagination_class"] = pagination_klass
+
+    if options.get("fast_read", False):
+        attrs["fast_read"] = True
+    if SETTINGS.get("query-guard", False):
+        attrs["query_guard"] = True
+
+    bases = _get_action_mixins(options) + (ModelViewSet,)
+
+    # Response caching is configured by override or by the cache setting,
+    # keyed like the blacklist.
+    pth = "%s-%s" % (model._meta.app_label, model._meta.model_name)
+    cache_options = options.get(
+        "cache", SETTINGS.get("cache", {}).get(pth, None)
+    )
+    if cache_options:
+        if cache_options is True:
+            cache_options = {}
+        attrs["cache_options"] = dict(cache_options)
+        attrs["cache_models"] = cache.get_linked_models(
+            model, serializer_klass
+        )
+        cache.watch(
+            (model,) + attrs["cache_models"],
+            cache_options.get("alias", "default")
+        )
+        bases = (CacheMixin,) + bases
+
+    # Conditional requests are answered for the objects of models with a
+    # timestamp field unless disabled. Lists are only fingerprinted if asked
+    # for, since that aggregates over the table on every request.
+    timestamp_field = _get_timestamp_field(
+        model,
+        options.get("timestamp_field", SETTINGS.get("timestamp-field", "updated"))
+    )
+    conditional = options.get("conditional", None)
+    if conditional or ((conditional is None) and (timestamp_field is not None)):
+        attrs["timestamp_field"] = timestamp_field
+        attrs["conditional_lists"] = bool(conditional)
+        bases = (ConditionalMixin,) + bases
+
+    # Async views run the list and detail paths of the mixins above in the
+    # thread pool
+    if _is_async(prefix, options):
+        async_actions = ["create"]
+        if (CacheMixin not in bases) and (ConditionalMixin not in bases):
+            async_actions.append("retrieve")
+            if not any((attrs.get("fast_read"), attrs.get("query_guard"))):
+                async_actions.append("list")
+        attrs["async_actions"] = tuple(async_actions)
+        bases = (AsyncMixin,) + bases
+    return type(str("%sViewSet" % prefix), bases, attrs)
+
+
+def _get_action_mixins(options):
+    """Return the mixins that add extra actions, and so routes, to the
+    viewset built for options. Lazy placeholders get them too."""
+
+    # Import late because apps may not be loaded yet
+    from rest_framework_extras.viewsets import BulkMixin
+
+    if options.get("bulk", False):
+        return (BulkMixin,)
+    return ()
+
+
+def _is_async(prefix, options):
+    """Return whether the viewset for options should be async"""
+
+    # Import late because apps may not be loaded yet
+    from rest_framework_extras import asynchronous
+
+    if not options.get("async", False):
+        return False
+    if not asynchronous.SUPPORTED:
+        logger.warning(
+            "DRFE: async viewsets need Django 3.1 or later. %s is "
+            "synchronous." % prefix
+        )
+        return False
+    if options.get("streaming", False):
+        logger.warning(
+            "DRFE: streaming viewsets can't be async. %s is synchronous." % \
+                prefix
+        )
+        return False
+    return True
+
+
+def _parse_pattern(el):
+    """Split an only or override entry into a lookup dictionary and the
+    options for the matching models."""
+
+    options = {}
+    if isinstance(el, (list, tuple)):
+        pattern_or_name, options = el
+        admin = options.get("admin", None)
+        admin_site = options.get("admin_site", None)
+        if any((admin, admin_site)) and not all((admin, admin_site)):
+            raise RuntimeError("admin and admin_site are mutually inclusive")
+    else:
+        pattern_or_name = el
+    try:
+        app_label, model = re.split(r"[\.-]", pattern_or_name)
+        di = {"app_label": app_label, "model": model}
+    except ValueError:
+        di = {"app_label": pattern_or_name}
+    return di, options
+
+
+def _get_contenttypes_filters(only=None, override=None):
+    """Find models through the content types table. Returns None if the table
+    is not available."""
 
     # Import late because apps may not be loaded yet
     from django.contrib.contenttypes.models import ContentType
-    from rest_framework import viewsets
 
     # Upon first migrate the contenttypes have not been loaded yet
     try:
         list(ContentType.objects.all())
     except (OperationalError, ProgrammingError):
-        return False
+        return None
 
     filters = OrderedDict()
 
@@ -50,81 +262,258 @@ def discover(router, override=None, only=None, exclude=None):
     if only is None:
         for app in reversed(settings.INSTALLED_APPS):
             for ct in ContentType.objects.filter(app_label=app.split(".")[-1]):
-                filters["%s.%s" % (ct.app_label, ct.model)] = {"content_type": ct}
+                filters["%s.%s" % (ct.app_label, ct.model)] = {
+                    "app_label": ct.app_label,
+                    "model_name": ct.model,
+                    "model": ct.model_class(),
+                    "options": {},
+                    "pattern": None
+                }
 
     # Parse the setting
-    for el in ((only or []) or (override or [])):
-        pattern_or_name = form = admin = admin_site = None
-        if isinstance(el, (list, tuple)):
-            pattern_or_name, di = el
-            form = di.get("form", None)
-            admin = di.get("admin", None)
-            admin_site = di.get("admin_site", None)
-            if any((admin, admin_site)) and not all((admin, admin_site)):
-                raise RuntimeError("admin and admin_site are mutually inclusive")
-        else:
-            pattern_or_name = el
-        di = {}
-        try:
-            app_label, model = re.split(r"[\.-]", pattern_or_name)
-            di = {"app_label": app_label, "model": model}
-        except ValueError:
-            di = {"app_label": pattern_or_name}
+    for i, el in enumerate((only or []) or (override or [])):
+        di, options = _parse_pattern(el)
         for ct in ContentType.objects.filter(**di):
             filters["%s.%s" % (ct.app_label, ct.model)] = {
-                "content_type": ct,
-                "form": form,
-                "admin": admin,
-                "admin_site": admin_site
+                "app_label": ct.app_label,
+                "model_name": ct.model,
+                "model": ct.model_class(),
+                "options": options,
+                "pattern": i
             }
 
+    return filters
+
+
+def _get_apps_filters(only=None, override=None):
+    """Find models through the app registry without touching the
+    database."""
+
+    # Import late because apps may not be loaded yet
+    from django.apps import apps
+
+    def get_models(app_label, model=None):
+        try:
+            app_config = apps.get_app_config(app_label)
+            if model is None:
+                return list(app_config.get_models())
+            return [app_config.get_model(model)]
+        except LookupError:
+            return []
+
+    filters = OrderedDict()
+
+    # If only is set it trumps normal discovery
+    if only is None:
+        for app_config in reversed(list(apps.get_app_configs())):
+            for model in app_config.get_models():
+                filters[model._meta.label_lower] = {
+                    "app_label": model._meta.app_label,
+                    "model_name": model._meta.model_name,
+                    "model": model,
+                    "options": {},
+                    "pattern": None
+                }
+
+    # Parse the setting
+    for i, el in enumerate((only or []) or (override or [])):
+        di, options = _parse_pattern(el)
+        for model in get_models(**di):
+            filters[model._meta.label_lower] = {
+                "app_label": model._meta.app_label,
+                "model_name": model._meta.model_name,
+                "model": model,
+                "options": options,
+                "pattern": i
+            }
+
+    return filters
+
+
+DISCOVERY_BACKENDS = {
+    "contenttypes": _get_contenttypes_filters,
+    "apps": _get_apps_filters,
+}
+
+
+def _get_manifest_hash(backend, only, override, SETTINGS):
+    """Return a hash of everything that influences the outcome of discovery
+    so a stale manifest can be detected."""
+
+    # Import late because apps may not be loaded yet
+    from django.apps import apps
+
+    def names(elements):
+        if elements is None:
+            return None
+        return [
+            el[0] if isinstance(el, (list, tuple)) else el for el in elements
+        ]
+
+    structure = {
+        "installed_apps": list(settings.INSTALLED_APPS),
+        "models": [
+            [
+                model._meta.label_lower,
+                [[f.name, f.__class__.__name__] for f in model._meta.get_fields()]
+            ]
+            for model in apps.get_models()
+        ],
+        "backend": backend,
+        "only": names(only),
+        "override": names(override),
+        "blacklist": sorted(SETTINGS["blacklist"]),
+    }
+    return hashlib.sha1(
+        json.dumps(structure, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def _load_manifest(path, digest, only, override):
+    """Return the filters stored in the manifest at path, or None if it is
+    missing or stale."""
+
+    # Import late because apps may not be loaded yet
+    from django.apps import apps
+
+    try:
+        with open(path, "r") as fp:
+            manifest = json.load(fp)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if manifest.get("hash") != digest:
+        logger.info("DRFE: discovery manifest %s is stale" % path)
+        return None
+
+    elements = (only or []) or (override or [])
+    filters = OrderedDict()
+    for pth, app_label, model_name, prefix, pattern in manifest["entries"]:
+        try:
+            model = apps.get_model(app_label, model_name)
+        except LookupError:
+            return None
+        options = {}
+        if pattern is not None:
+            el = elements[pattern]
+            if isinstance(el, (list, tuple)):
+                options = el[1]
+        filters[pth] = {
+            "app_label": app_label,
+            "model_name": model_name,
+            "model": model,
+            "options": options,
+            "pattern": pattern,
+            "prefix": prefix
+        }
+    return filters
+
+
+def _write_manifest(path, digest, entries):
+    # A unique file in the same directory, so concurrent writers don't clobber
+    # each other and the rename stays on one filesystem
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp"
+    )
+    try:
+        # mkstemp makes the file private to the owner
+        os.chmod(tmp, 0o644)
+        with os.fdopen(fd, "w") as fp:
+            json.dump({"hash": digest, "entries": entries}, fp)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    logger.info("DRFE: wrote discovery manifest %s" % path)
+
+
+@timed("discover")
+def discover(router, override=None, only=None, exclude=None, lazy=False,
+    backend=None):
+    """Generate default serializers and viewsets. This function should be run
+    before doing normal registration through the router.
+
+    If lazy is set only placeholders are registered and each viewset is built
+    when its route receives the first request.
+
+    Models are found through the content types table unless backend, or the
+    discovery-backend setting, is "apps". If the manifest setting is a path
+    the outcome is stored there and reused until the models change."""
+
+    # Import late because apps may not be loaded yet
+    from rest_framework_extras.viewsets import LazyViewSet
+
     if exclude is not None:
         raise NotImplementedError
 
     SETTINGS = get_settings()
+    if backend is None:
+        backend = SETTINGS.get("discovery-backend", "contenttypes")
+    try:
+        get_filters = DISCOVERY_BACKENDS[backend]
+    except KeyError:
+        raise ImproperlyConfigured(
+            "Unknown discovery backend %s" % backend
+        )
+
+    manifest = SETTINGS.get("manifest", None)
+    filters = digest = None
+    if manifest:
+        digest = _get_manifest_hash(backend, only, override, SETTINGS)
+        filters = _load_manifest(manifest, digest, only, override)
+    rebuild = manifest and (filters is None)
+
+    if filters is None:
+        filters = get_filters(only=only, override=override)
+        if filters is None:
+            return False
+
+    entries = []
     for di in filters.values():
-        ct = di["content_type"]
-        pth = r"%s-%s" % (ct.app_label, ct.model)
+        pth = r"%s-%s" % (di["app_label"], di["model_name"])
 
         # Skip over blacklisted app_label / model pairs
         if pth in SETTINGS["blacklist"]:
             continue
 
-        form = di.pop("form", None)
-        admin = di.pop("admin", None)
-        admin_site = di.pop("admin_site", None)
-        model = ct.model_class()
+        model = di["model"]
 
         # We can't handle a model without a manager
         if not hasattr(model, "objects"):
             continue
 
-        prefix = "%s%s" % (ct.app_label.capitalize(), model.__name__)
-        serializer_klass = type(
-            str("%sSerializer" % prefix),
-            (HyperlinkedModelSerializer,),
-            {
-                "model": model,
-                "form": form,
-                "admin": admin,
-                "admin_site": admin_site
-            }
-        )
-        viewset_klass = type(
-            str("%sViewSet" % prefix),
-            (viewsets.ModelViewSet,),
-            {
-                "serializer_class": serializer_klass,
-                "queryset": model.objects.all(),
-                "authentication_classes": SETTINGS["authentication-classes"],
-                "permission_classes": SETTINGS["permission-classes"]
-            }
-        )
+        prefix = di.get("prefix", None) \
+            or "%s%s" % (di["app_label"].capitalize(), model.__name__)
+        if lazy:
+            viewset_klass = type(
+                str("%sViewSet" % prefix),
+                _get_action_mixins(di["options"]) + (LazyViewSet,),
+                {
+                    "queryset": model.objects.all(),
+                    "is_async": _is_async(prefix, di["options"]),
+                    "factory": staticmethod(partial(
+                        _build_viewset, model, prefix, di["options"], SETTINGS
+                    ))
+                }
+            )
+        else:
+            viewset_klass = _build_viewset(
+                model, prefix, di["options"], SETTINGS
+            )
         logger.info("DRFE: registering API url %s" % pth)
         router.register(pth, viewset_klass)
+        entries.append(
+            [pth, di["app_label"], di["model_name"], prefix, di["pattern"]]
+        )
+
+    if rebuild:
+        _write_manifest(manifest, digest, entries)
+
+    clear_url_templates()
     return True
 
 
+@timed("register")
 def register(router, mapping=None):
     """Register all viewsets known to app, overriding any items already
     registered with the same name."""
@@ -164,3 +553,5 @@ def register(router, mapping=None):
                 klass,
                 basename=pth
             )
+
+    clear_url_templates()
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class RestFrameworkExtrasConfig(AppConfig):
+    name = "rest_framework_extras"
+    verbose_name = "Django Rest Framework Extras"
+
+    def ready(self):
+        from rest_framework_extras import cache
+        cache.watch_settings()
@@ -0,0 +1,240 @@
+"""Async viewsets for ASGI deployments. Discovered viewsets with the async
+option answer requests with coroutine views, so a worker is not held while the
+database is queried. Objects are read and created with the async ORM methods
+when Django has them. Authentication, permission checks, serializers, forms
+and every other sync path run in a thread pool of max_workers threads,
+configured by the async-pool setting and shared with password hashing:
+
+    "async-pool": {"max_workers": 8}
+
+Async views need Django 3.1 or later. Older versions get the regular viewsets.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, update_wrapper
+
+import django
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections
+from django.http import Http404
+
+from rest_framework import mixins, serializers, status
+from rest_framework.response import Response
+
+from rest_framework_extras import instrumentation
+from rest_framework_extras.querysets import split_many_to_many
+
+
+# Django runs coroutine views natively from 3.1 on
+SUPPORTED = django.VERSION >= (3, 1)
+
+_lock = threading.Lock()
+_executor = None
+_executor_workers = None
+
+
+def get_max_workers():
+    # Import late to avoid a circular import
+    from rest_framework_extras import get_settings
+    options = get_settings().get("async-pool", None) or {}
+    return options.get("max_workers", 8)
+
+
+def get_executor():
+    global _executor, _executor_workers
+    max_workers = get_max_workers()
+    with _lock:
+        if (_executor is None) or (_executor_workers != max_workers):
+            if _executor is not None:
+                # Work already submitted still runs, then the threads exit
+                _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(max_workers=max_workers)
+            _executor_workers = max_workers
+        return _executor
+
+
+def call(func, *args, **kwargs):
+    # Pool threads keep their own database connections, so expired ones are
+    # closed like at the end of a request
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def run_sync(func, *args, **kwargs):
+    """Run func in the thread pool and return an awaitable for its result"""
+
+    from asgiref.sync import SyncToAsync
+
+    executor = get_executor()
+    try:
+        return SyncToAsync(
+            partial(call, func), thread_sensitive=False, executor=executor
+        )(*args, **kwargs)
+    except TypeError:
+        # asgiref before 3.5 does not take an executor
+        return asyncio.get_event_loop().run_in_executor(
+            executor, partial(call, func, *args, **kwargs)
+        )
+
+
+async def load(queryset):
+    """Return the objects of queryset as a list"""
+
+    if hasattr(queryset, "__aiter__"):
+        return [obj async for obj in queryset]
+    return await run_sync(list, queryset)
+
+
+class AsyncMixin(object):
+    """Makes a viewset answer with coroutine views. The actions named in
+async_actions have async versions. Other actions, like update and destroy,
+run in the thread pool, as does anything a viewset does that may touch the
+database, so no sync ORM call happens on the event loop."""
+
+    async_actions = ("list", "retrieve", "create")
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        # Let the parent validate the arguments and set up the class
+        sync_view = super(AsyncMixin, cls).as_view(actions, **initkwargs)
+
+        async def view(request, *args, **kwargs):
+            self = cls(**initkwargs)
+            self.action_map = actions
+            for method, action in actions.items():
+                setattr(self, method, getattr(self, action))
+            if hasattr(self, "get") and not hasattr(self, "head"):
+                self.head = self.get
+            self.request = request
+            self.args = args
+            self.kwargs = kwargs
+            return await self.adispatch(request, *args, **kwargs)
+
+        update_wrapper(view, cls, updated=())
+        view.cls = cls
+        view.initkwargs = sync_view.initkwargs
+        view.actions = actions
+
+        # csrf_exempt would wrap the view in a sync function
+        view.csrf_exempt = True
+        return view
+
+    async def adispatch(self, request, *args, **kwargs):
+        with instrumentation.timer("request", view=self.__class__.__name__):
+            return await self._adispatch(request, *args, **kwargs)
+
+    async def _adispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await run_sync(self.initial, request, *args, **kwargs)
+
+            handler = None
+            if self.action in self.async_actions:
+                handler = getattr(self, "a%s" % self.action, None)
+            if handler is not None:
+                response = await handler(request, *args, **kwargs)
+            else:
+                method = request.method.lower()
+                if method in self.http_method_names:
+                    sync_handler = getattr(
+                        self, method, self.http_method_not_allowed
+                    )
+                else:
+                    sync_handler = self.http_method_not_allowed
+                response = await run_sync(
+                    sync_handler, request, *args, **kwargs
+                )
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        # Finalizing may render the response
+        self.response = await run_sync(
+            self.finalize_response, request, response, *args, **kwargs
+        )
+        return self.response
+
+    async def aget_serializer_data(self, *args, **kwargs):
+        # Serializers may read related objects
+        return await run_sync(
+            lambda: self.get_serializer(*args, **kwargs).data
+        )
+
+    async def aget_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        filters = {self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        try:
+            if hasattr(queryset, "aget"):
+                obj = await queryset.aget(**filters)
+            else:
+                obj = await run_sync(queryset.get, **filters)
+        except (queryset.model.DoesNotExist, TypeError, ValueError,
+            ValidationError):
+            raise Http404
+        await run_sync(self.check_object_permissions, self.request, obj)
+        return obj
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.paginator is not None:
+            page = await run_sync(
+                self.paginate_queryset, queryset
+            )
+            if page is not None:
+                data = await self.aget_serializer_data(page, many=True)
+                return self.get_paginated_response(data)
+        instances = await load(queryset)
+        return Response(
+            await self.aget_serializer_data(instances, many=True)
+        )
+
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        return Response(await self.aget_serializer_data(instance))
+
+    async def acreate(self, request, *args, **kwargs):
+        serializer = await run_sync(self.get_serializer, data=request.data)
+        await run_sync(serializer.is_valid, raise_exception=True)
+        await self.aperform_create(serializer)
+        data = await run_sync(lambda: serializer.data)
+        return Response(
+            data, status=status.HTTP_201_CREATED,
+            headers=self.get_success_headers(data)
+        )
+
+    async def aperform_create(self, serializer):
+        """Create the object with the async ORM if saving only writes the
+        model. Forms and overridden perform_create or create methods run in
+        the thread pool."""
+
+        model = self.get_queryset().model
+        manager = model._default_manager
+        if (getattr(serializer, "form_class", None) is not None) \
+            or not hasattr(manager, "acreate") \
+            or (type(self).perform_create
+                is not mixins.CreateModelMixin.perform_create) \
+            or (type(serializer).create
+                is not serializers.ModelSerializer.create):
+            await run_sync(self.perform_create, serializer)
+            return
+
+        validated_data = dict(serializer.validated_data)
+        many_to_many = split_many_to_many(model, validated_data)
+        instance = await manager.acreate(**validated_data)
+        if many_to_many:
+            await run_sync(self.set_many_to_many, instance, many_to_many)
+        serializer.instance = instance
+
+    def set_many_to_many(self, instance, many_to_many):
+        for field_name, values in many_to_many.items():
+            getattr(instance, field_name).set(values)
@@ -0,0 +1,237 @@
+"""Response cache for generated viewsets on top of the Django cache framework.
+
+Every watched model has a generation counter in the cache. Response keys
+include the generations of the model behind a route and of the models it links
+to, and the counters are bumped by the post_save, post_delete and m2m_changed
+signals, so a change makes earlier entries unreachable. Signals are only
+connected for watched models: those of cached viewsets and the models they
+link to, and the permission models when permission-cache is set. Models named
+by the cache and permission-cache settings are watched when the app is ready,
+so every process bumps their counters, whether or not it serves their routes,
+in the default cache, the caches named by those settings and the caches it
+watches. Processes sharing a file or memcached backend therefore see each
+other's changes while a local memory cache only sees changes made by its own
+process."""
+
+import hashlib
+import threading
+import time
+
+from django.core.cache import caches
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from rest_framework import relations
+
+
+KEY_PREFIX = "drfe"
+
+# Model label to the names of the caches holding its generation
+_watched = {}
+_lock = threading.Lock()
+
+
+def get_model_label(model):
+    return "%s.%s" % (model._meta.app_label, model._meta.model_name)
+
+
+def get_generation_key(label):
+    return "%s:generation:%s" % (KEY_PREFIX, label)
+
+
+def get_index_key(label):
+    return "%s:index:%s" % (KEY_PREFIX, label)
+
+
+def get_response_key(label, parts):
+    digest = hashlib.md5(
+        ":".join(str(part) for part in parts).encode("utf-8")
+    ).hexdigest()
+    return "%s:response:%s:%s" % (KEY_PREFIX, label, digest)
+
+
+def new_generation():
+    # Counters start at a time based value so a counter that was evicted
+    # never returns to an earlier value
+    return int(time.time() * 1000)
+
+
+def watch(models, alias="default"):
+    """Bump the generation of models in the named cache when they change"""
+
+    with _lock:
+        for model in models:
+            _watched.setdefault(get_model_label(model), set()).add(alias)
+            # Receivers are per model, so models nobody caches keep fast
+            # deletes and changes to them cost nothing
+            post_save.connect(
+                on_change, sender=model, dispatch_uid="drfe-cache-post-save"
+            )
+            post_delete.connect(
+                on_change, sender=model, dispatch_uid="drfe-cache-post-delete"
+            )
+            m2m_changed.connect(
+                on_m2m_change, sender=model,
+                dispatch_uid="drfe-cache-m2m-changed"
+            )
+
+
+def is_watched(model):
+    return get_model_label(model) in _watched
+
+
+def get_model_links(model):
+    """Return the models model relates to and the through models of its many
+    to many relations, like get_linked_models for a serializer of all
+    fields."""
+
+    result = []
+    for field in model._meta.get_fields():
+        if field.is_relation and field.concrete \
+            and (field.related_model is not None):
+            result.append(field.related_model)
+    for field in model._meta.many_to_many:
+        result.append(field.remote_field.through)
+
+    unique = []
+    for klass in result:
+        if (klass is not model) and (klass not in unique):
+            unique.append(klass)
+    return tuple(unique)
+
+
+def watch_settings():
+    """Watch the models named by the cache and permission-cache settings, so
+    a process invalidates their entries without discovering their routes"""
+
+    # Import late to avoid a circular import
+    from django.apps import apps
+    from rest_framework_extras import get_settings
+    from rest_framework_extras.permissions import get_cache_options, \
+        get_permission_models
+
+    for pth, options in (get_settings().get("cache", None) or {}).items():
+        if not options:
+            continue
+        try:
+            model = apps.get_model(*pth.split("-", 1))
+        except (LookupError, TypeError, ValueError):
+            continue
+        alias = "default"
+        if isinstance(options, dict):
+            alias = options.get("alias", "default")
+        watch((model,) + get_model_links(model), alias)
+
+    options = get_cache_options()
+    if options is not None:
+        watch(get_permission_models(), options.get("alias", "default"))
+
+
+def get_linked_models(model, serializer_class):
+    """Return the models the serializer links to and the through models of
+    model's many to many relations, whose changes alter its output."""
+
+    result = []
+    for field in serializer_class().fields.values():
+        if isinstance(field, relations.ManyRelatedField):
+            field = field.child_relation
+        queryset = getattr(field, "queryset", None)
+        if isinstance(field, relations.RelatedField) and (queryset is not None):
+            result.append(queryset.model)
+    for field in model._meta.many_to_many:
+        result.append(field.remote_field.through)
+
+    unique = []
+    for klass in result:
+        if (klass is not model) and (klass not in unique):
+            unique.append(klass)
+    return tuple(unique)
+
+
+def get_generations(models, alias="default"):
+    """Return the current generation for each of models"""
+
+    cache = caches[alias]
+    keys = [get_generation_key(get_model_label(model)) for model in models]
+    found = cache.get_many(keys)
+    result = []
+    for key in keys:
+        generation = found.get(key, None)
+        if generation is None:
+            cache.add(key, new_generation(), None)
+            generation = cache.get(key)
+        result.append(generation)
+    return result
+
+
+def get_aliases():
+    """Return the names of the caches that may hold generations"""
+
+    # Import late to avoid a circular import
+    from rest_framework_extras import get_settings
+
+    settings = get_settings()
+    aliases = set(["default"])
+    for options in (settings.get("cache", None) or {}).values():
+        if isinstance(options, dict):
+            aliases.add(options.get("alias", "default"))
+    options = settings.get("permission-cache", None)
+    if isinstance(options, dict):
+        aliases.add(options.get("alias", "default"))
+    with _lock:
+        for watched in _watched.values():
+            aliases.update(watched)
+    return aliases
+
+
+def bump(model):
+    """Invalidate the cached responses that depend on model, if it is
+    watched"""
+
+    if not is_watched(model):
+        return
+    key = get_generation_key(get_model_label(model))
+    for alias in get_aliases():
+        try:
+            caches[alias].incr(key)
+        except ValueError:
+            # Without a counter nothing was cached for it, and a new counter
+            # starts at a later value
+            pass
+
+
+def get_response(key, alias="default"):
+    return caches[alias].get(key)
+
+
+def set_response(label, key, value, timeout=300, max_entries=None,
+    alias="default"):
+    """Store a response. If max_entries is set the oldest entries for label
+    are deleted once there are more."""
+
+    cache = caches[alias]
+    cache.set(key, value, timeout)
+    if not max_entries:
+        return
+
+    index_key = get_index_key(label)
+    index = cache.get(index_key) or []
+    if key in index:
+        index.remove(key)
+    index.append(key)
+    if len(index) > max_entries:
+        cache.delete_many(index[:-max_entries])
+        index = index[-max_entries:]
+    cache.set(index_key, index, None)
+
+
+def on_change(sender, **kwargs):
+    bump(sender)
+
+
+def on_m2m_change(sender, instance, action, model=None, **kwargs):
+    if not action.startswith("post_"):
+        return
+    for klass in (sender, instance.__class__, model):
+        if klass is not None:
+            bump(klass)
+
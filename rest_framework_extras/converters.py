@@ -0,0 +1,231 @@
+"""Render rows read with values() the way HyperlinkedModelSerializer renders
+model instances. No model instances are created, links are built from the
+cached URL templates and many to many relations are read with one query per
+relation for a whole page."""
+
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models.query_utils import DeferredAttribute
+
+from rest_framework import fields, relations
+
+from rest_framework_extras.serializers import TEMPLATE_KEY_TYPES, \
+    CachedHyperlinkMixin, HyperlinkedModelSerializer, LRUCache, \
+    get_link_mode
+
+
+PLAIN = "plain"
+LINK = "link"
+MANY = "many"
+
+# Plans per serializer class and set of rendered fields. There are only a few
+# per serializer, so the cache is small and independent of form-cache-size.
+PLAN_CACHE_SIZE = 64
+_plans = LRUCache(PLAN_CACHE_SIZE)
+
+# Marks serializers that can't be rendered from rows
+_unsupported = object()
+
+
+def clear_row_converters():
+    _plans.clear()
+
+
+def get_link_builder(field, request):
+    """Return a function that renders a primary key the way the hyperlinked
+    field does."""
+
+    def render(pk):
+        return field.to_representation(relations.PKOnlyObject(pk=pk))
+
+    if get_link_mode(request) == "pk":
+        return lambda pk: pk
+    if field.lookup_field != "pk":
+        return render
+
+    format = field.context.get("format", None)
+    if format and field.format and (field.format != format):
+        format = field.format
+    template = field.get_url_template(field.view_name, request, format)
+    if not template:
+        return render
+
+    prefix, suffix = template
+
+    def build(pk):
+        if isinstance(pk, TEMPLATE_KEY_TYPES):
+            return "%s%s%s" % (prefix, pk, suffix)
+        return render(pk)
+
+    return build
+
+
+def get_many_lookup(model, name):
+    """Return (related model, lookup) for a to many relation so that
+    values_list(lookup, "pk") on the related model yields pairs of this
+    model's primary key and the related primary key."""
+
+    accessors = dict(
+        (rel.get_accessor_name(), rel) for rel in model._meta.related_objects
+    )
+    if name in accessors:
+        rel = accessors[name]
+        if rel.one_to_one:
+            return None
+        if rel.one_to_many and not rel.field.target_field.primary_key:
+            return None
+        return rel.related_model, rel.field.name
+
+    try:
+        model_field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+    if not model_field.many_to_many or not model_field.concrete:
+        return None
+    return model_field.related_model, model_field.related_query_name()
+
+
+def get_plan_entry(model, field):
+    """Return a (name, kind, column, lookup) tuple describing how to render
+    field from a row, or None if it can't be."""
+
+    if len(field.source_attrs) > 1:
+        return None
+
+    if isinstance(field, relations.HyperlinkedIdentityField):
+        if not isinstance(field, CachedHyperlinkMixin) or field.source != "*":
+            return None
+        return (field.field_name, LINK, "pk", None)
+
+    if not field.source_attrs:
+        return None
+    name = field.source_attrs[0]
+
+    if isinstance(field, relations.ManyRelatedField):
+        if not isinstance(field.child_relation, CachedHyperlinkMixin):
+            return None
+        lookup = get_many_lookup(model, name)
+        if lookup is None:
+            return None
+        return (field.field_name, MANY, "pk", lookup)
+
+    try:
+        model_field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+    if not model_field.concrete:
+        return None
+
+    if isinstance(field, CachedHyperlinkMixin):
+        if not (model_field.many_to_one or model_field.one_to_one):
+            return None
+        return (field.field_name, LINK, model_field.attname, None)
+
+    if isinstance(field, (relations.RelatedField, relations.ManyRelatedField)) \
+        or model_field.is_relation \
+        or (type(field).get_attribute is not fields.Field.get_attribute):
+        return None
+
+    # File fields and the like wrap the column value in their descriptor
+    if type(getattr(model, model_field.attname, None)) is not DeferredAttribute:
+        return None
+    return (field.field_name, PLAIN, model_field.attname, None)
+
+
+def get_plan(serializer):
+    """Return the plan entries for the readable fields of serializer, or None
+    if any of them can't be rendered from a row."""
+
+    readable = list(serializer._readable_fields)
+    klass = serializer.__class__
+    key = (klass, tuple(field.field_name for field in readable))
+    plan = _plans.get(key)
+    if plan is None:
+        plan = _unsupported
+        model = getattr(getattr(klass, "Meta", None), "model", None)
+        overridden = klass.to_representation \
+            is not HyperlinkedModelSerializer.to_representation
+        if (model is not None) and not overridden:
+            entries = [get_plan_entry(model, field) for field in readable]
+            if None not in entries:
+                plan = tuple(entries)
+        _plans.set(key, plan)
+    if plan is _unsupported:
+        return None
+    return plan
+
+
+class RowConverter(object):
+    """Converts the rows of a values() queryset for one serializer instance.
+    The queryset must select the columns given by columns."""
+
+    def __init__(self, serializer, plan):
+        self.serializer = serializer
+        self.plan = plan
+
+    @property
+    def columns(self):
+        columns = set(column for name, kind, column, lookup in self.plan)
+        columns.add("pk")
+        return columns
+
+    def get_related_pks(self, lookup, pks):
+        """Map each primary key in pks to a list of related primary keys"""
+
+        related_model, query_name = lookup
+        result = {}
+        if not pks:
+            return result
+        queryset = related_model._default_manager.filter(**{
+            "%s__in" % query_name: pks
+        }).values_list(query_name, "pk")
+        for pk, related_pk in queryset:
+            result.setdefault(pk, []).append(related_pk)
+        return result
+
+    def convert(self, rows):
+        rows = list(rows)
+        request = self.serializer.context.get("request", None)
+        serializer_fields = self.serializer.fields
+        pks = [row["pk"] for row in rows]
+
+        handlers = []
+        for name, kind, column, lookup in self.plan:
+            field = serializer_fields[name]
+            if kind == PLAIN:
+                handler = field.to_representation
+            elif kind == LINK:
+                handler = get_link_builder(field, request)
+            else:
+                handler = self.get_many_handler(
+                    get_link_builder(field.child_relation, request),
+                    self.get_related_pks(lookup, pks)
+                )
+            handlers.append((name, column, handler))
+
+        result = []
+        for row in rows:
+            di = OrderedDict()
+            for name, column, handler in handlers:
+                value = row[column]
+                di[name] = None if value is None else handler(value)
+            result.append(di)
+        return result
+
+    def get_many_handler(self, build, related_pks):
+
+        def handler(pk):
+            return [build(related_pk) for related_pk in related_pks.get(pk, ())]
+
+        return handler
+
+
+def get_row_converter(serializer):
+    """Return a RowConverter for serializer or None if the serializer renders
+    fields that can't be read from a row."""
+
+    plan = get_plan(serializer)
+    if plan is None:
+        return None
+    return RowConverter(serializer, plan)
@@ -0,0 +1,250 @@
+"""Timing and counter hooks for the hot paths of the package. Measurements go
+to a sink chosen by the instrumentation setting:
+
+    "instrumentation": {"sink": "logging"}
+    "instrumentation": {"sink": "memory"}
+    "instrumentation": {"sink": "prometheus", "path": "/tmp/drfe.prom"}
+
+The sink may also be a sink instance or the dotted path of a sink class. When
+no sink is configured every hook returns after checking a module global."""
+
+import logging
+import os
+import threading
+import time
+from functools import wraps
+
+import six
+
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger("django")
+
+# Marks that the setting has not been read yet
+_unset = object()
+_sink = _unset
+_lock = threading.Lock()
+
+
+class LoggingSink(object):
+    """Logs every measurement at debug level"""
+
+    def timing(self, name, seconds, labels):
+        logger.debug("DRFE: %s%s took %.3fms" % (
+            name, format_labels(labels), seconds * 1000
+        ))
+
+    def count(self, name, value, labels):
+        logger.debug("DRFE: %s%s counted %s" % (
+            name, format_labels(labels), value
+        ))
+
+
+class MemorySink(object):
+    """Aggregates measurements in memory. get returns a dictionary of
+    {(name, labels): {"count": n, "total": sum, "min": min, "max": max}}
+    where labels is a sorted tuple of (key, value) pairs."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+
+    def add(self, kind, name, value, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            entry = self.data.get(key, None)
+            if entry is None:
+                entry = self.data[key] = {
+                    "kind": kind, "count": 0, "total": 0,
+                    "min": value, "max": value
+                }
+            entry["count"] += 1
+            entry["total"] += value
+            entry["min"] = min(entry["min"], value)
+            entry["max"] = max(entry["max"], value)
+
+    def timing(self, name, seconds, labels):
+        self.add("timing", name, seconds, labels)
+
+    def count(self, name, value, labels):
+        self.add("count", name, value, labels)
+
+    def get(self):
+        with self.lock:
+            return dict((k, dict(v)) for k, v in self.data.items())
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+class PrometheusFileSink(MemorySink):
+    """Aggregates measurements in memory and writes them in the Prometheus
+    text format to path, at most once every interval seconds. Point the node
+    exporter's textfile collector at the directory. Errors writing the file
+    are logged, never raised."""
+
+    def __init__(self, path, interval=10):
+        super(PrometheusFileSink, self).__init__()
+        self.path = path
+        self.interval = interval
+        self.written = 0
+        self.flush_lock = threading.Lock()
+
+    def add(self, kind, name, value, labels):
+        super(PrometheusFileSink, self).add(kind, name, value, labels)
+        if time.time() - self.written >= self.interval:
+            self.flush()
+
+    def render(self):
+        lines = []
+        for (name, labels), entry in sorted(self.get().items()):
+            label_str = ",".join(
+                '%s="%s"' % (k, str(v).replace('"', '\\"')) for k, v in labels
+            )
+            label_str = "{%s}" % label_str if label_str else ""
+            if entry["kind"] == "timing":
+                metric = "drfe_%s_seconds" % name
+                lines.append("%s_count%s %s" % (metric, label_str, entry["count"]))
+                lines.append("%s_sum%s %r" % (metric, label_str, float(entry["total"])))
+            else:
+                metric = "drfe_%s_total" % name
+                lines.append("%s%s %s" % (metric, label_str, entry["total"]))
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        # Another thread is already writing
+        if not self.flush_lock.acquire(False):
+            return
+        try:
+            self.written = time.time()
+            tmp = "%s.%s.tmp" % (self.path, os.getpid())
+            with open(tmp, "w") as fp:
+                fp.write(self.render())
+            os.replace(tmp, self.path)
+        except (IOError, OSError) as exc:
+            logger.error("DRFE: could not write metrics to %s: %s" % (
+                self.path, exc
+            ))
+        finally:
+            self.flush_lock.release()
+
+
+SINKS = {
+    "logging": LoggingSink,
+    "memory": MemorySink,
+    "prometheus": PrometheusFileSink,
+}
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "[%s]" % ",".join("%s=%s" % i for i in sorted(labels.items()))
+
+
+def load_sink():
+    """Build the sink described by the instrumentation setting"""
+
+    # Import late to avoid a circular import
+    from rest_framework_extras import get_settings
+
+    options = get_settings().get("instrumentation", None)
+    if not options:
+        return None
+    options = dict(options)
+    sink = options.pop("sink", "logging")
+    if isinstance(sink, six.string_types):
+        sink = SINKS.get(sink, None) or import_string(sink)
+    if isinstance(sink, type):
+        sink = sink(**options)
+    return sink
+
+
+def get_sink():
+    global _sink
+    if _sink is _unset:
+        with _lock:
+            if _sink is _unset:
+                _sink = load_sink()
+    return _sink
+
+
+def set_sink(sink):
+    """Use sink instead of the one from settings. Pass None to disable."""
+    global _sink
+    _sink = sink
+
+
+def reset():
+    """Read the instrumentation setting again on next use"""
+    set_sink(_unset)
+
+
+class NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_null_timer = NullTimer()
+
+
+class Timer(object):
+
+    def __init__(self, sink, name, labels):
+        self.sink = sink
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.sink.timing(self.name, time.perf_counter() - self.start, self.labels)
+        return False
+
+
+def timer(name, **labels):
+    """Context manager that times its block"""
+
+    sink = _sink if _sink is not _unset else get_sink()
+    if sink is None:
+        return _null_timer
+    return Timer(sink, name, labels)
+
+
+def count(name, value=1, **labels):
+    sink = _sink if _sink is not _unset else get_sink()
+    if sink is not None:
+        sink.count(name, value, labels)
+
+
+def timed(name):
+    """Decorator that times every call of a function"""
+
+    def decorator(func):
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            sink = _sink if _sink is not _unset else get_sink()
+            if sink is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                sink.timing(name, time.perf_counter() - start, {})
+
+        return wrapper
+
+    return decorator
+
+
+def is_enabled():
+    return get_sink() is not None
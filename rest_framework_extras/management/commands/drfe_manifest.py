@@ -0,0 +1,47 @@
+import importlib
+import json
+import os
+import sys
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from rest_framework_extras import get_settings
+
+
+class Command(BaseCommand):
+    help = "Run discovery and write the manifest named by the manifest setting."
+
+    # Checks import the URL configuration, which would run discovery early.
+    # Django 3.2 takes a list of check tags and deprecates the bool.
+    requires_system_checks = [] if django.VERSION >= (3, 2) else False
+
+    def handle(self, *args, **options):
+        path = get_settings().get("manifest", None)
+        if not path:
+            raise CommandError(
+                "Set REST_FRAMEWORK_EXTRAS[\"manifest\"] to a file path."
+            )
+
+        if os.path.exists(path):
+            os.remove(path)
+
+        # Importing the URL configuration runs discover, which writes the
+        # manifest because there is none.
+        module = sys.modules.get(settings.ROOT_URLCONF, None)
+        if module is None:
+            importlib.import_module(settings.ROOT_URLCONF)
+        else:
+            importlib.reload(module)
+
+        if not os.path.exists(path):
+            raise CommandError(
+                "%s did not call discover." % settings.ROOT_URLCONF
+            )
+
+        with open(path, "r") as fp:
+            manifest = json.load(fp)
+        self.stdout.write(
+            "Wrote %s routes to %s" % (len(manifest["entries"]), path)
+        )
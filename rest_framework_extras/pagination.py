@@ -0,0 +1,35 @@
+from collections import OrderedDict
+
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+
+class KeysetPagination(CursorPagination):
+    """Cursor pagination over the primary key, or another indexed field set
+    as ordering. Pages are fetched with a WHERE clause instead of an OFFSET so
+    deep pages cost the same as the first one. The total is only counted if
+    include_count is set."""
+
+    ordering = "pk"
+    page_size = api_settings.PAGE_SIZE or 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+    include_count = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.include_count:
+            self.count = queryset.count()
+        return super(KeysetPagination, self).paginate_queryset(
+            queryset, request, view
+        )
+
+    def get_paginated_response(self, data):
+        if not self.include_count:
+            return super(KeysetPagination, self).get_paginated_response(data)
+        return Response(OrderedDict([
+            ("count", self.count),
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data)
+        ]))
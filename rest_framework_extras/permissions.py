@@ -0,0 +1,160 @@
+"""Django model and object permissions that read the user's permissions once
+per request. With the permission-cache setting the permissions are also kept
+in the Django cache between requests. Entries are dropped when permissions,
+groups or their memberships change, through the generations kept by the
+cache module."""
+
+from django.core.cache import caches
+from django.http import Http404
+
+from rest_framework import permissions
+from rest_framework.permissions import SAFE_METHODS
+
+from rest_framework_extras import cache
+
+
+def get_settings():
+    # Import late to avoid a circular import
+    from rest_framework_extras import get_settings
+    return get_settings()
+
+
+def get_permission_models():
+    """Return the models whose changes alter the permissions of users"""
+
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.models import Group, Permission
+
+    models = [Permission, Group, Group.permissions.through]
+    user_model = get_user_model()
+    for name in ("groups", "user_permissions"):
+        field = getattr(user_model, name, None)
+        if field is not None:
+            models.append(field.through)
+    return models
+
+
+def get_cache_options():
+    """Return the permission-cache setting as a dictionary or None"""
+
+    options = get_settings().get("permission-cache", None)
+    if not options:
+        return None
+    if options is True:
+        return {}
+    return options
+
+
+def load_permissions(user):
+    """Return the set of permissions user has through all backends, using the
+    cross request cache if it is configured."""
+
+    options = get_cache_options()
+    if options is None:
+        return set(user.get_all_permissions())
+
+    alias = options.get("alias", "default")
+    models = get_permission_models()
+    cache.watch(models, alias)
+    key = "%s:permissions:%s:%s" % (
+        cache.KEY_PREFIX,
+        user.pk,
+        ":".join(str(g) for g in cache.get_generations(models, alias))
+    )
+    backend = caches[alias]
+    result = backend.get(key)
+    if result is None:
+        result = set(user.get_all_permissions())
+        backend.set(key, result, options.get("timeout", 300))
+    return result
+
+
+def get_permission_set(request):
+    """Return the permissions of the user making request, loaded once per
+    request."""
+
+    user = request.user
+    cached = getattr(request, "_drfe_permissions", None)
+    if (cached is not None) and (cached[0] is user):
+        return cached[1]
+
+    if not user.is_active or not user.is_authenticated:
+        result = frozenset()
+    else:
+        result = frozenset(load_permissions(user))
+    request._drfe_permissions = (user, result)
+    return result
+
+
+def has_perms(request, perms, obj=None):
+    """Replaces user.has_perms. Model permissions are read from the
+    permission set. Object permissions still go through the backends since
+    they may depend on the object, but each answer is kept for the rest of the
+    request."""
+
+    user = request.user
+    if user.is_active and user.is_superuser:
+        return True
+    if obj is None:
+        return set(perms) <= get_permission_set(request)
+
+    answers = getattr(request, "_drfe_object_permissions", None)
+    if answers is None:
+        answers = request._drfe_object_permissions = {}
+    key = (user.pk, tuple(perms), obj.__class__, obj.pk)
+    if key not in answers:
+        answers[key] = user.has_perms(perms, obj)
+    return answers[key]
+
+
+class PermissionSetMixin(object):
+
+    def get_model(self, view):
+        # The queryset attribute is cheaper than calling get_queryset for
+        # every object on list and bulk paths
+        queryset = getattr(view, "queryset", None)
+        if queryset is None:
+            queryset = view.get_queryset()
+        return queryset.model
+
+    def has_permission(self, request, view):
+        if getattr(view, "_ignore_model_permissions", False):
+            return True
+
+        user = request.user
+        if not user or (
+            not user.is_authenticated and self.authenticated_users_only):
+            return False
+
+        perms = self.get_required_permissions(
+            request.method, self.get_model(view)
+        )
+        return has_perms(request, perms)
+
+
+class DjangoModelPermissions(PermissionSetMixin, permissions.DjangoModelPermissions):
+    pass
+
+
+class DjangoModelPermissionsOrAnonReadOnly(PermissionSetMixin, permissions.DjangoModelPermissionsOrAnonReadOnly):
+    pass
+
+
+class DjangoObjectPermissions(PermissionSetMixin, permissions.DjangoObjectPermissions):
+
+    def has_object_permission(self, request, view, obj):
+        model = self.get_model(view)
+        perms = self.get_required_object_permissions(request.method, model)
+
+        if not has_perms(request, perms, obj):
+            if request.method in SAFE_METHODS:
+                raise Http404
+
+            read_perms = self.get_required_object_permissions("GET", model)
+            if not has_perms(request, read_perms, obj):
+                raise Http404
+
+            return False
+
+        return True
+
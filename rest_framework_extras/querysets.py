@@ -0,0 +1,134 @@
+from contextlib import ExitStack, contextmanager
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+from django.db.models import Prefetch
+
+from rest_framework import relations
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+from rest_framework.utils import model_meta
+
+
+class QueryCounter(object):
+    """Database execute wrapper that counts queries"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_queries():
+    """Count the queries run on any database connection inside the block"""
+
+    counter = QueryCounter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+        yield counter
+
+
+def get_related_lookups(model, serializer_class):
+    """Inspect the fields a serializer will render and return a tuple of
+    (select_related, prefetch_related) lookups that avoid a query per row."""
+
+    select_related = []
+    prefetch_related = []
+    accessors = dict(
+        (rel.get_accessor_name(), rel) for rel in model._meta.related_objects
+    )
+
+    for field in serializer_class().fields.values():
+        if field.write_only or not field.source_attrs:
+            continue
+
+        # Relations may be wrapped for many=True
+        relation = field
+        if isinstance(field, relations.ManyRelatedField):
+            relation = field.child_relation
+        pk_only = isinstance(relation, relations.RelatedField) \
+            and relation.use_pk_only_optimization() \
+            and len(field.source_attrs) == 1
+
+        name = field.source_attrs[0]
+        if name in accessors:
+            rel = accessors[name]
+            if rel.one_to_one:
+                select_related.append(name)
+            elif pk_only and not rel.many_to_many:
+                # The foreign key column is needed to attach the objects
+                prefetch_related.append(Prefetch(
+                    name,
+                    queryset=rel.related_model._default_manager.only(
+                        "pk", rel.field.attname
+                    )
+                ))
+            elif pk_only:
+                prefetch_related.append(Prefetch(
+                    name,
+                    queryset=rel.related_model._default_manager.only("pk")
+                ))
+            else:
+                prefetch_related.append(name)
+            continue
+
+        try:
+            model_field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if not model_field.is_relation or model_field.related_model is None:
+            continue
+
+        if model_field.many_to_many or model_field.one_to_many:
+            if pk_only:
+                prefetch_related.append(Prefetch(
+                    name,
+                    queryset=model_field.related_model._default_manager.only("pk")
+                ))
+            else:
+                prefetch_related.append(name)
+        elif model_field.concrete and not pk_only:
+            # The pk only optimization reads the column directly, so only
+            # relations that need the full object are joined.
+            select_related.append(name)
+
+    return tuple(select_related), tuple(prefetch_related)
+
+
+def get_lazy_fields(serializer, instances):
+    """Return a list of (field name, queries) for the fields of serializer
+    that query the database while rendering instances. Pass instances that
+    have not been rendered yet, since related objects loaded once are kept on
+    the instance."""
+
+    result = []
+    for field in serializer._readable_fields:
+        with count_queries() as counter:
+            for instance in instances:
+                try:
+                    attribute = field.get_attribute(instance)
+                except SkipField:
+                    continue
+                check = attribute.pk if isinstance(attribute, PKOnlyObject) \
+                    else attribute
+                if check is not None:
+                    field.to_representation(attribute)
+        if counter.count:
+            result.append((field.field_name, counter.count))
+    return result
+
+
+def split_many_to_many(model, validated_data):
+    """Remove the many to many values from validated_data and return them as
+    a dictionary, since they can only be set once the object exists."""
+
+    info = model_meta.get_field_info(model)
+    many_to_many = {}
+    for field_name, relation_info in info.relations.items():
+        if relation_info.to_many and (field_name in validated_data):
+            many_to_many[field_name] = validated_data.pop(field_name)
+    return many_to_many
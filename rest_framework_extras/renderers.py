@@ -0,0 +1,105 @@
+"""Compact binary renderers. They need the msgpack and cbor2 packages, which
+are optional. Renderers whose package is missing are left out of discovered
+viewsets.
+
+Binary payloads are usually consumed by other services, which may prefer
+links as primary keys or paths. Set link_mode on a subclass to change the
+default, which clients can still override with the links query parameter:
+
+    class CompactMessagePackRenderer(MessagePackRenderer):
+        link_mode = "pk"
+"""
+
+import logging
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+logger = logging.getLogger("django")
+
+# Renderers that were reported missing
+_reported = set()
+
+
+def get_available(renderer_classes):
+    """Return the renderer classes whose packages are installed"""
+
+    result = []
+    for klass in renderer_classes:
+        is_available = getattr(klass, "is_available", None)
+        if (is_available is None) or is_available():
+            result.append(klass)
+        elif klass not in _reported:
+            _reported.add(klass)
+            logger.warning(
+                "DRFE: %s is left out since its package is not installed" % \
+                    klass.__name__
+            )
+    return tuple(result)
+
+
+class BinaryRenderer(BaseRenderer):
+    charset = None
+    render_style = "binary"
+
+    # None leaves links absolute unless the request asks otherwise
+    link_mode = None
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def get_default(self):
+        # Types JSON can encode, like dates and decimals, are encoded the same
+        # way
+        return JSONEncoder().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return self.dumps(data)
+
+
+class MessagePackRenderer(BinaryRenderer):
+    media_type = "application/msgpack"
+    format = "msgpack"
+
+    @classmethod
+    def is_available(cls):
+        return msgpack is not None
+
+    def dumps(self, data):
+        return msgpack.packb(
+            data, default=self.get_default(), use_bin_type=True
+        )
+
+
+class CBORRenderer(BinaryRenderer):
+    media_type = "application/cbor"
+    format = "cbor"
+
+    @classmethod
+    def is_available(cls):
+        return cbor2 is not None
+
+    def dumps(self, data):
+        return cbor2.dumps(data, default=self.get_cbor_default())
+
+    def get_cbor_default(self):
+        default = self.get_default()
+
+        def encode(encoder, value):
+            encoder.encode(default(value))
+
+        return encode
@@ -0,0 +1,67 @@
+"""A per process cache of URL templates. Reversing a URL walks the resolver,
+so hyperlinked serializers resolve each view name once with a placeholder
+primary key and fill in the real key for every link."""
+
+from django.urls import NoReverseMatch
+
+from rest_framework.reverse import reverse
+
+
+# Stands in for the primary key when resolving a URL template. Digits only so
+# it matches the common lookup patterns.
+PK_PLACEHOLDER = "90210902109021090210"
+
+_path_templates = {}
+
+
+def clear_url_templates():
+    """Discard all cached templates. Call this when the URL configuration
+    changes."""
+    _path_templates.clear()
+
+
+def get_path_template(view_name, lookup_url_kwarg, request, format=None):
+    """Return a (prefix, suffix) tuple of paths that surround the primary key,
+    None if the view can't be reversed or False if the URL can't be expressed
+    as a template."""
+
+    versioning_scheme = getattr(request, "versioning_scheme", None)
+    key = (
+        view_name,
+        getattr(request, "version", None),
+        versioning_scheme.__class__,
+        lookup_url_kwarg,
+        format
+    )
+    try:
+        return _path_templates[key]
+    except KeyError:
+        pass
+
+    try:
+        url = reverse(
+            view_name,
+            kwargs={lookup_url_kwarg: PK_PLACEHOLDER},
+            request=request,
+            format=format
+        )
+    except NoReverseMatch:
+        template = None
+    else:
+        root = request.build_absolute_uri("/")[:-1]
+        if url.startswith(root) and (url.count(PK_PLACEHOLDER) == 1):
+            template = tuple(url[len(root):].split(PK_PLACEHOLDER))
+        else:
+            template = False
+    _path_templates[key] = template
+    return template
+
+
+def get_url_template(view_name, lookup_url_kwarg, request, format=None):
+    """Absolute variant of get_path_template for the host of the request."""
+
+    template = get_path_template(view_name, lookup_url_kwarg, request, format)
+    if not template:
+        return template
+    root = request.build_absolute_uri("/")[:-1]
+    return (root + template[0], template[1])
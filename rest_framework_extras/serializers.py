@@ -1,22 +1,164 @@
+import copy
 import logging
+import threading
+import uuid
+import weakref
 from collections import OrderedDict
 
 import six
 
+from django import forms
 from django.db.models.base import Model
 from django.core.exceptions import ImproperlyConfigured
-from django.utils.translation import ugettext_lazy as _
 
 from rest_framework import serializers, relations
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+
+from rest_framework_extras.instrumentation import timed
+from rest_framework_extras.reverse import get_path_template, get_url_template
 
 
 logger = logging.getLogger("django")
 
 
-class RelaxedHyperlinkedRelatedField(relations.HyperlinkedRelatedField):
+def get_sparse_fields(request):
+    """Return the sets of field names given in the fields and omit query
+    parameters, or None for a parameter that is absent. Only reads are
+    narrowed."""
+
+    if (request is None) or (request.method not in SAFE_METHODS):
+        return None, None
+    params = getattr(request, "query_params", request.GET)
+    result = []
+    for param in ("fields", "omit"):
+        value = params.get(param, None)
+        if value is None:
+            result.append(None)
+        else:
+            result.append(set(n.strip() for n in value.split(",") if n.strip()))
+    return tuple(result)
+
+
+# How links are rendered. See get_link_mode.
+LINK_MODES = ("absolute", "path", "pk")
+
+
+def get_link_mode(request):
+    """Return "absolute" for absolute URLs, "path" for URL paths or "pk" for
+    primary keys. Clients choose with the links query parameter, otherwise
+    the link_mode of the negotiated renderer applies. The mode is kept on the
+    request."""
+
+    if request is None:
+        return "absolute"
+    try:
+        return request._drfe_link_mode
+    except AttributeError:
+        pass
+    params = getattr(request, "query_params", request.GET)
+    mode = params.get("links", None)
+    if mode not in LINK_MODES:
+        renderer = getattr(request, "accepted_renderer", None)
+        mode = getattr(renderer, "link_mode", None) or "absolute"
+    request._drfe_link_mode = mode
+    return mode
+
+
+# Primary key types that are safe to append to a URL template
+TEMPLATE_KEY_TYPES = six.integer_types + (uuid.UUID,)
+
+
+class CachedHyperlinkMixin(object):
+    """Builds links to primary keys by filling in a URL template that is
+resolved once per view name. Depending on the link mode of the request links
+are absolute URLs, paths or primary keys."""
+
+    def __init__(self, *args, **kwargs):
+        super(CachedHyperlinkMixin, self).__init__(*args, **kwargs)
+        self._url_templates = {}
+
+    def get_url_template(self, view_name, request, format):
+        relative = get_link_mode(request) == "path"
+        key = (view_name, format, relative)
+        try:
+            return self._url_templates[key]
+        except KeyError:
+            pass
+        template = (get_path_template if relative else get_url_template)(
+            view_name, self.lookup_url_kwarg, request, format
+        )
+        self._url_templates[key] = template
+        return template
+
+    def get_url(self, obj, view_name, request, format):
+        pk = getattr(obj, "pk", None)
+        if (self.lookup_field == "pk") and isinstance(pk, TEMPLATE_KEY_TYPES):
+            template = self.get_url_template(view_name, request, format)
+            if template:
+                return "%s%s%s" % (template[0], pk, template[1])
+        url = super(CachedHyperlinkMixin, self).get_url(
+            obj, view_name, request, format
+        )
+        if url and (get_link_mode(request) == "path"):
+            root = request.build_absolute_uri("/")[:-1]
+            if url.startswith(root):
+                url = url[len(root):]
+        return url
+
+    def to_representation(self, value):
+        if get_link_mode(self.context.get("request", None)) == "pk":
+            return value.pk
+        return super(CachedHyperlinkMixin, self).to_representation(value)
+
+
+class HyperlinkedRelatedField(CachedHyperlinkMixin, relations.HyperlinkedRelatedField):
+    pass
+
+
+class HyperlinkedIdentityField(CachedHyperlinkMixin, relations.HyperlinkedIdentityField):
+    pass
+
+
+class RelaxedManyRelatedField(relations.ManyRelatedField):
+    """Provide only primary keys to the child relation if it can make do with
+them. Prefetched objects are used if available, otherwise the keys are
+fetched with values_list and no model instances are created."""
+
+    def get_attribute(self, instance):
+        if not self.child_relation.use_pk_only_optimization() \
+            or (len(self.source_attrs) != 1):
+            return super(RelaxedManyRelatedField, self).get_attribute(instance)
+
+        if instance.pk is None:
+            return []
+
+        relationship = getattr(instance, self.source_attrs[0])
+        if not hasattr(relationship, "get_queryset"):
+            return super(RelaxedManyRelatedField, self).get_attribute(instance)
+
+        queryset = relationship.get_queryset()
+        if queryset._result_cache is not None:
+            return [relations.PKOnlyObject(pk=obj.pk) for obj in queryset]
+        return [
+            relations.PKOnlyObject(pk=pk)
+            for pk in queryset.values_list("pk", flat=True)
+        ]
+
+
+class RelaxedHyperlinkedRelatedField(HyperlinkedRelatedField):
     """DRF does not provide a convenient hook to exclude fields which don't
 have a target view. A custom field class at least returns a string."""
 
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {"child_relation": cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in relations.MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return RelaxedManyRelatedField(**list_kwargs)
+
+    @timed("hyperlink")
     def to_representation(self, value):
         try:
             return super(
@@ -26,6 +168,82 @@ have a target view. A custom field class at least returns a string."""
             return "__not_implemented__"
 
 
+class LRUCache(object):
+    """A bounded, least recently used cache of at most maxsize entries"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_maxsize(self):
+        return self.maxsize
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return None
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        maxsize = self.get_maxsize()
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class FormClassCache(LRUCache):
+    """A bounded, least recently used cache for the form classes that
+ModelAdmin.get_form builds. Its size is the form-cache-size setting unless
+maxsize is given."""
+
+    def __init__(self, maxsize=None):
+        super(FormClassCache, self).__init__(maxsize)
+
+    def get_maxsize(self):
+        if self.maxsize is not None:
+            return self.maxsize
+        # Import late because of circular imports
+        from rest_framework_extras import get_settings
+        return get_settings().get("form-cache-size", 128)
+
+
+form_class_cache = FormClassCache()
+partial_form_class_cache = FormClassCache()
+
+
+def clear_form_class_cache():
+    """Discard all cached admin form classes, eg. after changing permissions
+    or admin configuration at runtime."""
+    form_class_cache.clear()
+    partial_form_class_cache.clear()
+
+
+# Initial values of form fields per form class, for forms that don't
+# override __init__
+_form_initials = weakref.WeakKeyDictionary()
+
+# Form constructors that leave the initial values of fields alone
+PLAIN_FORM_INITS = (forms.BaseForm.__init__, forms.BaseModelForm.__init__)
+
+
+def get_field_initials(fields):
+    initials = OrderedDict()
+    for field_name, field in fields.items():
+        if field.initial:
+            initials[field_name] = field.initial
+    return initials
+
+
 class FormMixin(object):
     """Delegates validation to a normal Django form.
     Example:
@@ -35,6 +253,11 @@ class FormMixin(object):
 
     @property
     def form_class(self):
+        try:
+            return self._form_class
+        except AttributeError:
+            pass
+
         form_klass = getattr(self.Meta, "form", None)
         admin_klass = getattr(self.Meta, "admin", None)
         admin_site = getattr(self.Meta, "admin_site", None)
@@ -42,45 +265,124 @@ class FormMixin(object):
             if not admin_site:
                 # Fall back to default
                 from django.contrib.admin import site as admin_site
-            return  admin_klass(self.Meta.model, admin_site).get_form(
-                self.context["request"], self.initial
+            request = self.context["request"]
+            obj = self.initial
+            form_klass = key = None
+            if obj is None:
+                key = (
+                    admin_klass, self.Meta.model, admin_site,
+                    self.get_form_cache_key(request)
+                )
+                form_klass = form_class_cache.get(key)
+            if form_klass is None:
+                form_klass = admin_klass(self.Meta.model, admin_site).get_form(
+                    request, obj
+                )
+                if key is not None:
+                    form_class_cache.set(key, form_klass)
+        self._form_class = form_klass
+        return form_klass
+
+    def get_form_cache_key(self, request):
+        """Return the parts of the request that influence the form an admin
+        builds. Override this if the admin inspects more of the request."""
+
+        user = getattr(request, "user", None)
+        if user is None:
+            return None
+        return (
+            user.is_active,
+            user.is_staff,
+            user.is_superuser,
+            frozenset(user.get_all_permissions())
+        )
+
+    def get_partial_form_class(self, form_class, keys):
+        """Return a subclass of form_class limited to the fields in keys. The
+        subclasses are cached per set of keys."""
+
+        keys = frozenset(k for k in keys if k in form_class.base_fields)
+        cache_key = (form_class, keys)
+        klass = partial_form_class_cache.get(cache_key)
+        if klass is None:
+            klass = type(form_class.__name__, (form_class,), {})
+            klass.base_fields = OrderedDict(
+                (k, v) for k, v in form_class.base_fields.items() if k in keys
             )
-        elif form_klass:
-            return form_klass
-        return None
+            partial_form_class_cache.set(cache_key, klass)
+        return klass
 
+    @timed("form_get_cached_form")
     def get_cached_form(self, data=None):
         if hasattr(self, "_form"):
             return self._form
 
         form_class = self.form_class
         if form_class:
-            setattr(self, "_form", form_class(
-                data,
-                instance=self.instance if isinstance(self.instance, Model) \
-                    else None)
-            )
+            instance = self.instance if isinstance(self.instance, Model) \
+                else None
+
+            # Partial updates only validate the submitted fields
+            if (data is not None) and self.partial:
+                try:
+                    form = self.get_partial_form_class(form_class, data.keys())(
+                        data, instance=instance
+                    )
+                except KeyError:
+                    # The form's constructor expects fields that were left
+                    # out, so discard them from a full form instead.
+                    form = form_class(data, instance=instance)
+                    for name in list(form.fields.keys()):
+                        if name not in data:
+                            del form.fields[name]
+            else:
+                form = form_class(data, instance=instance)
+            setattr(self, "_form", form)
             return self._form
 
         return None
 
+    def get_form_initials(self, form_class):
+        """Return the initial values of the form fields. Forms that don't
+        override __init__ are not constructed and their declared initials are
+        kept per form class. Other forms may derive initials from the
+        instance, so one is constructed for the instance unless the form
+        already built for validation fits."""
+
+        if form_class.__init__ in PLAIN_FORM_INITS:
+            try:
+                return _form_initials[form_class]
+            except KeyError:
+                pass
+            initials = get_field_initials(form_class.base_fields)
+            _form_initials[form_class] = initials
+            return initials
+
+        instance = self.instance if isinstance(self.instance, Model) else None
+        form = getattr(self, "_form", None)
+        if (form is None) or self.partial or (
+            (form.instance is not instance) if instance is not None
+            else (form.instance.pk is not None)
+        ):
+            form = form_class(instance=instance)
+        return get_field_initials(form.fields)
+
     def get_initial(self):
         form_class = self.form_class
         if not form_class:
             return super(FormMixin, self).get_initial()
 
-        # We need a fresh instance to get initial values
-        form = form_class(
-            instance=self.instance if isinstance(self.instance, Model) else None
-        )
         res = OrderedDict()
-        for field_name, field in form.fields.items():
-            if field.initial:
+        for field_name, initial in self.get_form_initials(form_class).items():
+            if field_name in self.fields:
+                if callable(initial):
+                    initial = initial()
                 res[field_name] = self.fields[field_name].to_representation(
-                    field.initial
+                    initial
                 )
         return res
 
+    @timed("form_validate")
     def validate(self, attrs):
         """Delegate validation to form if it is set"""
 
@@ -105,36 +407,15 @@ not in the serializer %s. You may encounter problems.""" % \
             )
 
         if not form.is_valid():
-
-            # Patch requests don't necessarily contain all the fields. Discard
-            # validation errors on those not present.
-            if self.context["request"].method.lower() == "patch":
-                logger.warning("""DRFE: doing a PATCH for serializer %s with \
-form %s. You may encounter problems.""" % \
-                    (self.__class__.__name__, form_class.__name__)
-                )
-
-                to_delete_keys = []
-                for k, v in form.errors.items():
-                    # This string matching is ugly but our only option
-                    if v == [_("This field is required.")]:
-                        to_delete_keys.append(k)
-                        exclude = list(getattr(form.Meta, "exclude", []))
-                        exclude.append(k)
-                        setattr(form.Meta, "exclude", exclude)
-
-                for k in to_delete_keys:
-                    del form.errors[k]
-                    del form.fields[k]
-
             # Map global error
-            if "__all__" in form.errors:
-                form.errors["non_field_errors"] = form.errors["__all__"]
-                del form.errors["__all__"]
-            raise serializers.ValidationError(form.errors)
+            errors = dict(form.errors)
+            if "__all__" in errors:
+                errors["non_field_errors"] = errors.pop("__all__")
+            raise serializers.ValidationError(errors)
 
         return super(FormMixin, self).validate(attrs)
 
+    @timed("form_save")
     def save(self, **kwargs):
         """Delegate save to form if it is set"""
 
@@ -142,13 +423,7 @@ form %s. You may encounter problems.""" % \
         if not form:
             return super(FormMixin, self).save(**kwargs)
 
-        try:
-            self.instance = form.save()
-        except Exception as exc:
-            if self.context["request"].method.lower() == "patch":
-                raise """DRFE: save failed with %s. This may be because \
- request was a PATCH.""" % exc
-            raise
+        self.instance = form.save()
         return self.instance
 
 
@@ -175,6 +450,68 @@ class SerializerMeta(serializers.SerializerMetaclass):
         return cls
 
 
+def copy_field(field):
+    """Return an unbound copy of a field built by ModelSerializer. The field
+    is instantiated again with the arguments it was created with, which are
+    shared instead of deep copied. Many related fields get a copy of their
+    child relation."""
+
+    kwargs = field._kwargs
+    if "child_relation" in kwargs:
+        kwargs = dict(kwargs)
+        kwargs["child_relation"] = copy_field(kwargs["child_relation"])
+    return field.__class__(*field._args, **kwargs)
+
+
 @six.add_metaclass(SerializerMeta)
 class HyperlinkedModelSerializer(FormMixin, serializers.HyperlinkedModelSerializer):
+    """Renders only the fields named by the fields query parameter, minus the
+    ones named by omit. Other fields are never constructed.
+
+    Inspecting the model to build the fields is done once per class. Every
+    instance gets copies of the fields in that field map."""
+
     serializer_related_field = RelaxedHyperlinkedRelatedField
+    serializer_url_field = HyperlinkedIdentityField
+
+    def get_field_map(self):
+        """Return the fields for all the field names, built once per class"""
+
+        klass = self.__class__
+        field_map = klass.__dict__.get("_field_map", None)
+        if field_map is None:
+            field_map = super(HyperlinkedModelSerializer, self).get_fields()
+            klass._field_map = field_map
+        return field_map
+
+    def get_fields(self):
+        if self.url_field_name is None:
+            self.url_field_name = api_settings.URL_FIELD_NAME
+
+        field_map = self.get_field_map()
+        declared_fields = self._declared_fields
+        fields = OrderedDict()
+        for name in self.get_sparse_field_names(list(field_map.keys())):
+            field = field_map[name]
+            if (name in declared_fields) \
+                or isinstance(field, (serializers.HiddenField, serializers.BaseSerializer)):
+                # Declared fields may hold state, so copy them like DRF does
+                fields[name] = copy.deepcopy(field)
+            else:
+                fields[name] = copy_field(field)
+        return fields
+
+    def get_sparse_field_names(self, names):
+        # Nested serializers render in full
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if parent is not None:
+            return names
+
+        fields, omit = get_sparse_fields(self.context.get("request", None))
+        if fields is not None:
+            names = [name for name in names if name in fields]
+        if omit:
+            names = [name for name in names if name not in omit]
+        return names
@@ -0,0 +1,135 @@
+"""Test helpers for projects that use discover and register.
+
+find_n_plus_one renders the list of every route of a router for the first N
+and the first 2N objects and reports the routes whose query count grows with
+the number of objects, with the fields responsible. Routes with fewer than 2N
+objects can't be checked and issue a SkippedRouteWarning. assertNoNPlusOne
+fails for them unless allow_skipped is set, so create enough objects first:
+
+    from rest_framework_extras.testing import NPlusOneMixin
+
+    class ApiTestCase(NPlusOneMixin, TestCase):
+
+        def test_queries(self):
+            self.assertNoNPlusOne(router, n=5, user=self.superuser)
+"""
+
+import warnings
+
+from django.contrib.auth.models import AnonymousUser
+
+from rest_framework import viewsets
+from rest_framework.test import APIRequestFactory
+
+from rest_framework_extras.querysets import count_queries, get_lazy_fields
+from rest_framework_extras.viewsets import LazyViewSet
+
+
+class SkippedRouteWarning(UserWarning):
+    """Issued for a route with too few objects to be checked"""
+
+
+def get_view(viewset_class, prefix, user=None):
+    """Return an instance of viewset_class set up for a list request"""
+
+    request = APIRequestFactory().get("/%s/" % prefix)
+    view = viewset_class(action_map={"get": "list"}, args=(), kwargs={})
+    view.action = "list"
+    view.format_kwarg = None
+    view.request = view.initialize_request(request)
+    view.request.user = user or AnonymousUser()
+    return view
+
+
+def count_list_queries(view, queryset, size):
+    """Return the queries run to load and serialize the first size objects"""
+
+    with count_queries() as counter:
+        instances = list(queryset[:size])
+        view.get_serializer(instances, many=True).data
+    return counter.count
+
+
+def check_viewset(viewset_class, prefix, n=5, user=None):
+    """Return a dictionary describing the query growth of the list of
+    viewset_class, or None if it does not grow. If there are fewer than 2N
+    objects a SkippedRouteWarning is issued and None is returned."""
+
+    if issubclass(viewset_class, LazyViewSet):
+        viewset_class = viewset_class.get_viewset_class()
+    view = get_view(viewset_class, prefix, user)
+    queryset = view.filter_queryset(view.get_queryset())
+    rows = queryset.count()
+    if rows < 2 * n:
+        warnings.warn(
+            "%s has %s objects, fewer than the %s needed to check it" % (
+                prefix, rows, 2 * n
+            ),
+            SkippedRouteWarning
+        )
+        return None
+
+    counts = (
+        count_list_queries(view, queryset, n),
+        count_list_queries(view, queryset, 2 * n)
+    )
+    if counts[1] <= counts[0]:
+        return None
+    return {
+        "prefix": prefix,
+        "model": queryset.model,
+        "queries": counts,
+        "fields": [
+            name for name, queries in get_lazy_fields(
+                view.get_serializer(), list(queryset[:n])
+            )
+        ]
+    }
+
+
+def find_n_plus_one(router, n=5, user=None):
+    """Return a list of dictionaries, one per route of router whose list runs
+    more queries for 2N objects than for N. See check_viewset."""
+
+    result = []
+    seen = set()
+    for prefix, viewset_class, basename in router.registry:
+        # register adds its routes twice
+        if (prefix, viewset_class) in seen \
+            or not issubclass(viewset_class, viewsets.GenericViewSet):
+            continue
+        seen.add((prefix, viewset_class))
+        problem = check_viewset(viewset_class, prefix, n, user)
+        if problem is not None:
+            result.append(problem)
+    return result
+
+
+class NPlusOneMixin(object):
+    """Mixin for unittest test cases"""
+
+    def assertNoNPlusOne(self, router, n=5, user=None, allow_skipped=False):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always", SkippedRouteWarning)
+            problems = find_n_plus_one(router, n, user)
+
+        messages = [
+            "%s runs %s queries for %s objects and %s for %s. Fields: %s" % (
+                p["prefix"], p["queries"][0], n, p["queries"][1], 2 * n,
+                ", ".join(
+                    "%s.%s" % (p["model"]._meta.label, f)
+                    for f in p["fields"]
+                ) or "unknown"
+            ) for p in problems
+        ]
+        for warning in caught:
+            if not issubclass(warning.category, SkippedRouteWarning):
+                # Pass on warnings that are not ours
+                warnings.warn_explicit(
+                    warning.message, warning.category, warning.filename,
+                    warning.lineno
+                )
+            elif not allow_skipped:
+                messages.append(str(warning.message))
+        if messages:
+            self.fail("\n".join(messages))
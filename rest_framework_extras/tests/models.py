@@ -36,3 +36,8 @@ class WithTrickyForm(Base):
 
 class WithAdminClass(Base):
     pass
+
+
+class WithTimestamp(models.Model):
+    editable_field = models.CharField(max_length=32)
+    updated = models.DateTimeField(auto_now=True)
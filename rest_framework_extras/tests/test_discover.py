@@ -1,3 +1,6 @@
+import json
+import os
+import tempfile
 import unittest
 
 try:
@@ -5,7 +8,17 @@ try:
 except ImportError:
     from django.core.urlresolvers import reverse
 
-from rest_framework_extras import get_settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from rest_framework import routers
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from rest_framework_extras import discover, get_settings
+from rest_framework_extras.tests import forms
+from rest_framework_extras.viewsets import LazyViewSet
 
 
 class DiscoverTestCase(unittest.TestCase):
@@ -38,3 +51,123 @@ class DiscoverTestCase(unittest.TestCase):
         for name, klass, model_name in router.registry:
             self.failIf(name in get_settings()["blacklist"])
 
+    def test_lazy(self):
+        router = routers.SimpleRouter()
+        discover(router, only=["tests.vanilla"], lazy=True)
+        name, klass = router.registry[0][:2]
+        self.assertEqual(name, "tests-vanilla")
+        self.assertEqual(klass.__name__, "TestsVanillaViewSet")
+        self.assertTrue(issubclass(klass, LazyViewSet))
+        self.failIf("viewset_class" in klass.__dict__)
+
+        # The viewset is built on the first request and then reused
+        view = klass.as_view({"get": "list"})
+        request = APIRequestFactory().get("/tests-vanilla/")
+        force_authenticate(
+            request, get_user_model()(is_superuser=True, is_active=True)
+        )
+        self.assertEqual(view(request).status_code, 200)
+        built = klass.viewset_class
+        self.assertEqual(built.__name__, "TestsVanillaViewSet")
+        self.assertEqual(view(request).status_code, 200)
+        self.assertTrue(klass.get_viewset_class() is built)
+
+    def test_lazy_routes(self):
+        names = []
+        for lazy in (False, True):
+            router = routers.SimpleRouter()
+            discover(router, only=[("tests.vanilla", {"bulk": True})], lazy=lazy)
+            names.append(sorted(url.name for url in router.urls))
+        self.assertTrue("vanilla-bulk" in names[0], names[0])
+        self.assertEqual(names[0], names[1])
+
+    def test_pagination_options(self):
+        router = routers.SimpleRouter()
+        discover(
+            router,
+            only=[("tests.vanilla", {"ordering": "-pk", "count": True})]
+        )
+        klass = router.registry[0][1]
+        pagination_klass = klass.pagination_class
+        self.assertEqual(pagination_klass.ordering, "-pk")
+        self.assertTrue(pagination_klass.include_count)
+
+        view = klass.as_view({"get": "list"})
+        request = APIRequestFactory().get("/tests-vanilla/")
+        force_authenticate(
+            request, get_user_model()(is_superuser=True, is_active=True)
+        )
+        response = view(request)
+        self.assertEqual(list(response.data.keys())[0], "count")
+
+        router = routers.SimpleRouter()
+        discover(router, only=[("tests.vanilla", {"pagination_class": None})])
+        self.assertFalse("pagination_class" in router.registry[0][1].__dict__)
+
+    def test_apps_backend(self):
+        router = routers.SimpleRouter()
+        with CaptureQueriesContext(connection) as context:
+            discover(router, backend="apps")
+        self.assertEqual(len(context.captured_queries), 0)
+
+        # Same routes as through content types
+        control = routers.SimpleRouter()
+        discover(control)
+        self.assertEqual(
+            sorted(tu[0] for tu in router.registry),
+            sorted(tu[0] for tu in control.registry)
+        )
+
+        router = routers.SimpleRouter()
+        discover(
+            router,
+            only=["tests.vanilla", "tests-bar", "nothing.here"],
+            backend="apps"
+        )
+        self.assertEqual(
+            [tu[0] for tu in router.registry], ["tests-vanilla", "tests-bar"]
+        )
+
+    def test_manifest(self):
+        path = os.path.join(tempfile.mkdtemp(), "manifest.json")
+        override = [("tests.withform", dict(form=forms.WithFormForm))]
+        SETTINGS = dict(get_settings(), manifest=path)
+        with override_settings(REST_FRAMEWORK_EXTRAS=SETTINGS):
+            control = routers.SimpleRouter()
+            discover(control, override=override)
+            self.assertTrue(os.path.exists(path))
+
+            # The manifest replaces the content types queries
+            router = routers.SimpleRouter()
+            with CaptureQueriesContext(connection) as context:
+                discover(router, override=override)
+            self.assertEqual(len(context.captured_queries), 0)
+            self.assertEqual(
+                [(tu[0], tu[1].__name__) for tu in router.registry],
+                [(tu[0], tu[1].__name__) for tu in control.registry]
+            )
+            for name, klass in [tu[:2] for tu in router.registry]:
+                if name == "tests-withform":
+                    self.assertEqual(
+                        klass.serializer_class.Meta.form, forms.WithFormForm
+                    )
+
+            # A stale manifest is rebuilt
+            with open(path, "r") as fp:
+                manifest = json.load(fp)
+            manifest["hash"] = "stale"
+            with open(path, "w") as fp:
+                json.dump(manifest, fp)
+            discover(routers.SimpleRouter(), override=override)
+            with open(path, "r") as fp:
+                self.assertNotEqual(json.load(fp)["hash"], "stale")
+
+            os.remove(path)
+            call_command("drfe_manifest", stdout=open(os.devnull, "w"))
+            self.assertTrue(os.path.exists(path))
+
+            # Writes leave no temporary files behind
+            self.assertEqual(
+                os.listdir(os.path.dirname(path)), ["manifest.json"]
+            )
+        os.remove(path)
@@ -3,7 +3,9 @@ import json
 
 
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test.client import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
 try:
     from django.urls import reverse
 except ImportError:
@@ -11,6 +13,8 @@ except ImportError:
 
 from rest_framework.test import APIRequestFactory, APIClient
 
+from rest_framework_extras import get_settings
+from rest_framework_extras import instrumentation
 from rest_framework_extras.tests import models
 
 
@@ -212,3 +216,78 @@ class UsersTestCase(unittest.TestCase):
         response = self.client.patch("/auth-user/%s/" % self.user.pk, data)
         self.failIf("is_staff" in as_json)
         self.failIf(self.user_model.objects.get(pk=self.user.pk).is_staff)
+
+    def test_user_queryset(self):
+        # Users read only their own row and the columns they are shown
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/auth-user/%s/" % self.user.pk)
+        self.assertEqual(response.status_code, 200)
+        sql = [q["sql"] for q in context.captured_queries if "auth_user" in q["sql"]]
+        self.assertEqual(len(sql), 1)
+        self.failIf("password" in sql[0])
+        self.failIf("is_superuser" in sql[0])
+
+        # Other rows are refused without a query
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/auth-user/%s/" % self.staff.pk)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(len(context.captured_queries), 0)
+
+    def test_staff_visibility(self):
+        self.client.force_authenticate(self.staff)
+        settings = dict(
+            get_settings(), **{"staff-user-visibility": "non-superusers"}
+        )
+        with override_settings(REST_FRAMEWORK_EXTRAS=settings):
+            response = self.client.get("/auth-user/")
+            usernames = [di["username"] for di in response.json()]
+            self.assertTrue("staff" in usernames)
+            self.failIf("superuser" in usernames)
+            response = self.client.get("/auth-user/%s/" % self.superuser.pk)
+            self.assertEqual(response.status_code, 404)
+
+    def test_user_password_writes(self):
+        self.client.force_authenticate(self.superuser)
+
+        def writes(context):
+            return [
+                q["sql"] for q in context.captured_queries
+                if q["sql"].startswith(("INSERT", "UPDATE"))
+                and "auth_user\"" in q["sql"].split("SET")[0]
+            ]
+
+        settings = dict(
+            get_settings(),
+            **{"password-hashing": {"offload": True}}
+        )
+        self.addCleanup(instrumentation.reset)
+        for offload in (False, True):
+            sink = instrumentation.MemorySink()
+            instrumentation.set_sink(sink)
+            with override_settings(
+                REST_FRAMEWORK_EXTRAS=settings if offload else get_settings()
+            ):
+                with CaptureQueriesContext(connection) as context:
+                    response = self.client.post("/auth-user/", {
+                        "username": "tpw%s" % offload,
+                        "password": "password"
+                    })
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(len(writes(context)), 1)
+                obj = self.user_model.objects.get(username="tpw%s" % offload)
+                self.assertTrue(obj.check_password("password"))
+
+                with CaptureQueriesContext(connection) as context:
+                    response = self.client.patch(
+                        "/auth-user/%s/" % obj.pk, {"password": "changed"}
+                    )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(writes(context)), 1)
+                obj = self.user_model.objects.get(pk=obj.pk)
+                self.assertTrue(obj.check_password("changed"))
+
+                metrics = sink.get()
+                self.assertEqual(metrics[("password_hash", ())]["count"], 2)
+                self.assertEqual(metrics[("user_write", ())]["count"], 2)
+                obj.delete()
@@ -1,17 +1,46 @@
+import asyncio
 import unittest
 import json
+import os
+import tempfile
+import time
+import uuid
 
 
+from django.contrib import admin
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser, Group, Permission
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.test.client import Client, RequestFactory
+from django.utils.http import http_date
 try:
     from django.urls import reverse
 except ImportError:
     from django.core.urlresolvers import reverse
 
-from rest_framework.test import APIRequestFactory, APIClient
+from rest_framework import permissions, relations, routers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APIClient, \
+    force_authenticate
 
-from rest_framework_extras.tests import models
+from rest_framework_extras import asynchronous, cache as drfe_cache, \
+    converters, discover, get_settings, instrumentation, register, renderers, \
+    reverse as drfe_reverse
+from rest_framework_extras import _get_timestamp_field as drfe_get_timestamp_field
+from rest_framework_extras.converters import get_row_converter
+from rest_framework_extras.permissions import DjangoModelPermissions
+from rest_framework_extras import serializers as serializers_module
+from rest_framework_extras.serializers import FormClassCache, \
+    HyperlinkedModelSerializer, HyperlinkedRelatedField, \
+    RelaxedHyperlinkedRelatedField, clear_form_class_cache
+from rest_framework_extras.testing import NPlusOneMixin, \
+    SkippedRouteWarning, find_n_plus_one
+from rest_framework_extras.tests import forms, models
 
 
 def get_control(model="vanilla", pk=1, another_editable_field_suffix=""):
@@ -26,7 +55,7 @@ def get_control(model="vanilla", pk=1, another_editable_field_suffix=""):
      }
 
 
-class ViewsTestCase(unittest.TestCase):
+class ViewsTestCase(NPlusOneMixin, unittest.TestCase):
 
     @classmethod
     def setUpClass(cls):
@@ -74,7 +103,606 @@ class ViewsTestCase(unittest.TestCase):
     def test_vanilla_list(self):
         response = self.client.get("/tests-vanilla/")
         as_json = response.json()
-        self.assertEqual(as_json[0], get_control())
+        self.assertEqual(as_json["results"][0], get_control())
+
+    def test_vanilla_list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get("/tests-vanilla/")
+        n = len(context.captured_queries)
+
+        # More rows may not result in more queries
+        objs = []
+        for i in range(3):
+            obj = models.Vanilla.objects.create(
+                editable_field="editable_field",
+                another_editable_field="another_editable_field",
+                foreign_field=models.Foo.objects.create()
+            )
+            obj.many_field.set([self.bar, models.Bar.objects.create()])
+            objs.append(obj)
+        try:
+            with CaptureQueriesContext(connection) as context:
+                self.client.get("/tests-vanilla/")
+            self.assertEqual(len(context.captured_queries), n)
+        finally:
+            for obj in objs:
+                obj.delete()
+
+    def test_vanilla_n_plus_one(self):
+        from rest_framework_extras.tests.urls import router
+
+        objs = []
+        for i in range(4):
+            obj = models.Vanilla.objects.create(
+                editable_field="editable_field",
+                another_editable_field="another_editable_field",
+                foreign_field=models.Foo.objects.create()
+            )
+            obj.many_field.set([self.bar, models.Bar.objects.create()])
+            objs.append(obj)
+        try:
+            # Every generated route runs a fixed number of queries. Routes
+            # with few objects can't be checked.
+            self.assertNoNPlusOne(
+                router, n=2, user=self.editor, allow_skipped=True
+            )
+
+            # Skipped routes are reported
+            vanilla = routers.SimpleRouter()
+            discover(vanilla, only=["tests.vanilla"])
+            count = models.Vanilla.objects.count()
+            with self.assertWarns(SkippedRouteWarning):
+                self.assertEqual(
+                    find_n_plus_one(vanilla, n=count, user=self.editor), []
+                )
+            with self.assertRaises(AssertionError) as context:
+                self.assertNoNPlusOne(vanilla, n=count, user=self.editor)
+            self.assertTrue(
+                "tests-vanilla has %s objects, fewer than the %s needed" % (
+                    count, 2 * count
+                ) in str(context.exception)
+            )
+
+            # Without prefetching the many to many field is read per object
+            unguarded = routers.SimpleRouter()
+            discover(unguarded, only=[
+                ("tests.vanilla", {"prefetch_related": ()})
+            ])
+            problems = find_n_plus_one(unguarded, n=2, user=self.editor)
+            self.assertEqual(len(problems), 1)
+            self.assertEqual(problems[0]["model"], models.Vanilla)
+            self.assertEqual(problems[0]["fields"], ["many_field"])
+            self.assertEqual(
+                problems[0]["queries"][1] - problems[0]["queries"][0], 2
+            )
+
+            # The runtime guard logs the field
+            guarded = routers.SimpleRouter()
+            with override_settings(
+                REST_FRAMEWORK_EXTRAS=dict(get_settings(), **{"query-guard": True})
+            ):
+                discover(guarded, only=[
+                    ("tests.vanilla", {"prefetch_related": ()})
+                ])
+            view = guarded.registry[0][1].as_view({"get": "list"})
+            request = self.factory.get("/tests-vanilla/")
+            force_authenticate(request, self.editor)
+            with self.assertLogs("django", "WARNING") as logs:
+                response = view(request)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(logs.output), 1)
+            self.assertTrue("tests.Vanilla.many_field" in logs.output[0])
+        finally:
+            for obj in objs:
+                obj.delete()
+
+    def test_vanilla_pagination(self):
+        objs = [
+            models.Vanilla.objects.create(
+                editable_field="editable_field",
+                another_editable_field="another_editable_field",
+                foreign_field=self.foo
+            ) for i in range(3)
+        ]
+        try:
+            response = self.client.get("/tests-vanilla/?page_size=2")
+            as_json = response.json()
+            self.failIf("count" in as_json)
+            self.assertEqual(len(as_json["results"]), 2)
+            self.assertEqual(as_json["previous"], None)
+            seen = [di["url"] for di in as_json["results"]]
+
+            # Deep pages run the same queries as the first page
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(as_json["next"])
+            self.assertEqual(len(context.captured_queries), 2)
+            as_json = response.json()
+            for di in as_json["results"]:
+                self.failIf(di["url"] in seen)
+        finally:
+            for obj in objs:
+                obj.delete()
+
+    def test_vanilla_streaming(self):
+        router = routers.SimpleRouter()
+        discover(
+            router,
+            only=[("tests.vanilla", {"streaming": True, "chunk_size": 2})]
+        )
+        view = router.registry[0][1].as_view({"get": "list"})
+        objs = [
+            models.Vanilla.objects.create(
+                editable_field="editable_field",
+                another_editable_field="another_editable_field",
+                foreign_field=self.foo
+            ) for i in range(4)
+        ]
+        try:
+            request = self.factory.get("/tests-vanilla/")
+            force_authenticate(request, self.editor)
+            response = view(request)
+            self.assertTrue(response.streaming)
+            as_json = json.loads(b"".join(response.streaming_content))
+            control = self.client.get("/tests-vanilla/?page_size=1000").json()
+            self.assertEqual(as_json, control["results"])
+        finally:
+            for obj in objs:
+                obj.delete()
+
+    def test_vanilla_fast_read(self):
+        views = []
+        for options in ({}, {"fast_read": True}):
+            router = routers.SimpleRouter()
+            discover(router, only=[("tests.vanilla", options)])
+            views.append(router.registry[0][1].as_view({"get": "list"}))
+        bar = models.Bar.objects.create()
+        objs = [
+            models.Vanilla.objects.create(
+                editable_field="editable_field_%s" % i,
+                another_editable_field="another_editable_field",
+                foreign_field=self.foo
+            ) for i in range(3)
+        ]
+        objs[0].many_field.set([self.bar, bar])
+        objs[2].many_field.set([bar])
+        try:
+            for url in (
+                "/tests-vanilla/?page_size=2",
+                "/tests-vanilla/?page_size=1000",
+                "/tests-vanilla/?fields=url,many_field",
+                "/tests-vanilla/?omit=url,foreign_field",
+            ):
+                while url:
+                    contents = []
+                    for view in views:
+                        request = self.factory.get(url)
+                        force_authenticate(request, self.editor)
+                        response = view(request)
+                        response.render()
+                        contents.append(response.content)
+                    self.assertEqual(contents[0], contents[1])
+                    url = json.loads(contents[1].decode("utf-8"))["next"]
+
+            request = self.factory.get("/tests-vanilla/")
+            force_authenticate(request, self.editor)
+            response = views[1](request)
+            view = response.renderer_context["view"]
+            self.failIf(get_row_converter(view.get_serializer()) is None)
+        finally:
+            for obj in objs:
+                obj.delete()
+            bar.delete()
+
+    def test_vanilla_with_cache(self):
+        router = routers.SimpleRouter()
+        discover(router, only=[
+            ("tests.vanilla", {"cache": {"timeout": 60, "max_entries": 2}})
+        ])
+        klass = router.registry[0][1]
+        self.assertTrue(models.Bar in klass.cache_models)
+        list_view = klass.as_view({"get": "list"})
+        detail_view = klass.as_view({"get": "retrieve"})
+
+        def get(view, url="/tests-vanilla/", **kwargs):
+            request = self.factory.get(url)
+            force_authenticate(request, self.editor)
+            with CaptureQueriesContext(connection) as context:
+                response = view(request, **kwargs)
+                if hasattr(response, "render"):
+                    response.render()
+            return response, len(context.captured_queries)
+
+        response, n = get(list_view)
+        self.assertTrue(n > 0)
+        control = response.content
+        response, n = get(list_view)
+        self.assertEqual(n, 0)
+        self.assertEqual(response.content, control)
+        self.assertEqual(response["Content-Type"], "application/json")
+        detail_url = "/tests-vanilla/%s/" % self.vanilla.pk
+        response, n = get(detail_view, detail_url, pk=self.vanilla.pk)
+        self.assertTrue(n > 0)
+        response, n = get(detail_view, detail_url, pk=self.vanilla.pk)
+        self.assertEqual(n, 0)
+
+        # Changes to the model and linked models invalidate
+        bar = models.Bar.objects.create()
+        response, n = get(list_view)
+        self.assertTrue(n > 0)
+        self.vanilla.many_field.add(bar)
+        try:
+            response, n = get(list_view)
+            self.assertTrue(n > 0)
+            self.assertNotEqual(response.content, control)
+            self.assertEqual(get(list_view)[1], 0)
+        finally:
+            self.vanilla.many_field.remove(bar)
+            bar.delete()
+        response, n = get(list_view)
+        self.assertEqual(response.content, control)
+
+        # Processes that never discovered the route invalidate as well if
+        # the cache setting names the model
+        watched = dict(drfe_cache._watched)
+        drfe_cache._watched.clear()
+        try:
+            self.assertEqual(get(list_view)[1], 0)
+            self.vanilla.save()
+            self.assertEqual(get(list_view)[1], 0)
+            settings = dict(get_settings(), cache={"tests-vanilla": True})
+            with override_settings(REST_FRAMEWORK_EXTRAS=settings):
+                drfe_cache.watch_settings()
+            self.assertTrue(models.Bar in drfe_cache.get_model_links(
+                models.Vanilla
+            ))
+            self.vanilla.save()
+            self.assertTrue(get(list_view)[1] > 0)
+        finally:
+            drfe_cache._watched.update(watched)
+
+        # Models nobody caches are left alone and keep fast deletes
+        key = drfe_cache.get_generation_key(
+            drfe_cache.get_model_label(Session)
+        )
+        caches["default"].set(key, 5)
+        drfe_cache.bump(Session)
+        self.assertEqual(caches["default"].get(key), 5)
+        self.failIf(post_delete.has_listeners(Session))
+        self.assertTrue(post_delete.has_listeners(models.Vanilla))
+
+        # Only max_entries responses are kept
+        get(list_view, "/tests-vanilla/?page_size=1")
+        get(list_view, "/tests-vanilla/?page_size=2")
+        self.assertTrue(get(list_view)[1] > 0)
+
+    def test_vanilla_with_cache_per_user(self):
+        router = routers.SimpleRouter()
+        discover(router, only=[("tests.vanilla", {"cache": {"timeout": 60}})])
+        view = router.registry[0][1].as_view({"get": "list"})
+        other = get_user_model().objects.create(
+            username="other-editor", is_superuser=True, is_staff=True
+        )
+
+        def get(user, accept):
+            request = self.factory.get("/tests-vanilla/", HTTP_ACCEPT=accept)
+            force_authenticate(request, user)
+            with CaptureQueriesContext(connection) as context:
+                response = view(request)
+                if hasattr(response, "render"):
+                    response.render()
+            return response, len(context.captured_queries)
+
+        try:
+            # Browsable API pages show the user and are never cached
+            get(self.editor, "text/html")
+            response, n = get(other, "text/html")
+            self.assertTrue(n > 0)
+            content = response.content.decode("utf-8")
+            self.assertTrue("other-editor" in content)
+            self.failIf(">editor<" in content)
+
+            # JSON is shared by users of the same kind
+            get(self.editor, "application/json")
+            self.assertEqual(get(other, "application/json")[1], 0)
+        finally:
+            other.delete()
+
+    def test_vanilla_with_cache_and_bulk(self):
+        router = routers.SimpleRouter()
+        discover(router, only=[
+            ("tests.vanilla", {"cache": {"timeout": 60}, "bulk": True})
+        ])
+        klass = router.registry[0][1]
+        list_view = klass.as_view({"get": "list"})
+        detail_view = klass.as_view({"get": "retrieve"})
+        bulk_view = klass.as_view({"post": "bulk", "patch": "bulk"})
+
+        def get(view=detail_view, url="/tests-vanilla/%s/" % self.vanilla.pk):
+            request = self.factory.get(url)
+            force_authenticate(request, self.editor)
+            response = view(request, pk=self.vanilla.pk)
+            if hasattr(response, "render"):
+                response.render()
+            return json.loads(response.content.decode("utf-8"))
+
+        def count():
+            return len(get(list_view, "/tests-vanilla/?page_size=1000")["results"])
+
+        def bulk(method, data):
+            request = getattr(self.factory, method)(
+                "/tests-vanilla/bulk/", data, format="json"
+            )
+            force_authenticate(request, self.editor)
+            return bulk_view(request)
+
+        original = self.vanilla.another_editable_field
+        self.assertEqual(get()["another_editable_field"], original)
+        try:
+            # Bulk writes send no signals but still invalidate
+            response = bulk("patch", [
+                {"pk": self.vanilla.pk, "another_editable_field": "bulk"}
+            ])
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(get()["another_editable_field"], "bulk")
+
+            n = count()
+            response = bulk("post", [{
+                "editable_field": "cache_bulk",
+                "another_editable_field": "another_editable_field",
+                "foreign_field": "http://testserver/tests-foo/%s/" % self.foo.pk,
+                "many_field": ["http://testserver/tests-bar/%s/" % self.bar.pk],
+            }])
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(count(), n + 1)
+        finally:
+            models.Vanilla.objects.filter(editable_field="cache_bulk").delete()
+            models.Vanilla.objects.filter(pk=self.vanilla.pk).update(
+                another_editable_field=original
+            )
+
+    def test_vanilla_with_bulk(self):
+        router = routers.SimpleRouter()
+        discover(router, only=[("tests.vanilla", {"bulk": True})])
+        view = router.registry[0][1].as_view({
+            "post": "bulk", "put": "bulk", "patch": "bulk", "delete": "bulk"
+        })
+
+        def call(method, data):
+            request = getattr(self.factory, method)(
+                "/tests-vanilla/bulk/", data, format="json"
+            )
+            force_authenticate(request, self.editor)
+            return view(request)
+
+        item = {
+            "editable_field": "bulk",
+            "another_editable_field": "another_editable_field",
+            "foreign_field": "http://testserver/tests-foo/1/",
+            "many_field": ["http://testserver/tests-bar/1/"],
+        }
+
+        # Nothing is written if any item is invalid
+        n = models.Vanilla.objects.count()
+        response = call("post", [item, {"editable_field": "bulk"}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertTrue("foreign_field" in response.data[1])
+        self.assertEqual(models.Vanilla.objects.count(), n)
+
+        response = call("post", [item, item])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data), 2)
+        query = models.Vanilla.objects.filter(editable_field="bulk")
+        self.assertEqual(query.count(), 2)
+        self.assertEqual(
+            [list(obj.many_field.all()) for obj in query], [[self.bar]] * 2
+        )
+        urls = [di["url"] for di in response.data]
+
+        response = call("patch", [
+            {"url": urls[0], "another_editable_field": "x"},
+            {"pk": query[1].pk, "another_editable_field": "y"},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(query.values_list("another_editable_field", flat=True)),
+            ["x", "y"]
+        )
+
+        response = call("delete", [urls[0], query[1].pk, 0])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[:2], [{}, {}])
+
+        # Malformed primary keys are reported per item
+        for method in ("patch", "delete"):
+            response = call(method, [
+                {"pk": query[0].pk, "another_editable_field": "z"},
+                {"pk": "abc"}, {"pk": [1]}
+            ])
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data[0], {})
+            for error in response.data[1:]:
+                self.assertEqual(error, {"non_field_errors": ["Invalid pk."]})
+        self.assertEqual(query.count(), 2)
+
+        # Objects are checked like they are by destroy
+        class DenyObjects(permissions.BasePermission):
+            def has_object_permission(self, request, view, obj):
+                return obj.pk != query[1].pk
+
+        denying = type(
+            str("DenyingViewSet"), (router.registry[0][1],),
+            {"permission_classes": (DenyObjects,)}
+        ).as_view({"delete": "bulk"})
+        request = self.factory.delete(
+            "/tests-vanilla/bulk/", urls, format="json"
+        )
+        force_authenticate(request, self.editor)
+        self.assertEqual(denying(request).status_code, 403)
+        self.assertEqual(query.count(), 2)
+
+        response = call("delete", urls)
+        self.assertEqual(response.status_code, 204)
+        self.failIf(query.all().exists())
+
+    @unittest.skipUnless(
+        getattr(connection.features, "can_return_rows_from_bulk_insert", False),
+        "bulk_create returns no primary keys on this database"
+    )
+    def test_vanilla_with_bulk_returning(self):
+        router = routers.SimpleRouter()
+        discover(router, only=[
+            ("tests.vanilla", {"bulk": True, "cache": {"timeout": 60}})
+        ])
+        klass = router.registry[0][1]
+        list_view = klass.as_view({"get": "list"})
+        bulk_view = klass.as_view({"post": "bulk"})
+
+        def call(view, method, data=None):
+            request = getattr(self.factory, method)(
+                "/tests-vanilla/bulk/", data, format="json"
+            )
+            force_authenticate(request, self.editor)
+            with CaptureQueriesContext(connection) as context:
+                response = view(request)
+                response.render()
+            return response, [q["sql"] for q in context.captured_queries]
+
+        bar = models.Bar.objects.create()
+        items = [{
+            "editable_field": "returning",
+            "another_editable_field": "another_editable_field",
+            "foreign_field": "http://testserver/tests-foo/%s/" % self.foo.pk,
+            "many_field": [
+                "http://testserver/tests-bar/%s/" % pk for pk in pks
+            ],
+        } for pks in ((self.bar.pk,), (self.bar.pk, bar.pk))]
+        query = models.Vanilla.objects.filter(editable_field="returning")
+        try:
+            call(list_view, "get")
+            response, queries = call(bulk_view, "post", items)
+            self.assertEqual(response.status_code, 201)
+
+            # One insert for the objects and one for their relations
+            inserts = [sql for sql in queries if sql.startswith("INSERT")]
+            self.assertEqual(len(inserts), 2)
+            self.assertEqual(
+                [sorted(obj.many_field.values_list("pk", flat=True))
+                    for obj in query.order_by("pk")],
+                [[self.bar.pk], sorted([self.bar.pk, bar.pk])]
+            )
+            self.assertEqual(
+                [len(di["many_field"]) for di in response.data], [1, 2]
+            )
+
+            # The cached list is invalidated although no signal was sent
+            self.assertTrue(call(list_view, "get")[1])
+        finally:
+            query.delete()
+            bar.delete()
+
+    def test_async_pool_resize(self):
+        old = asynchronous.get_executor()
+        future = old.submit(time.sleep, 0.01)
+        settings = dict(get_settings(), **{"async-pool": {"max_workers": 3}})
+        with override_settings(REST_FRAMEWORK_EXTRAS=settings):
+            executor = asynchronous.get_executor()
+            self.assertFalse(executor is old)
+            self.assertTrue(executor is asynchronous.get_executor())
+
+        # The replaced pool finishes its work and lets its threads go
+        self.assertEqual(future.result(), None)
+        self.assertRaises(RuntimeError, old.submit, time.sleep, 0)
+
+        # Back to the configured size for the other tests
+        asynchronous.get_executor()
+
+    @unittest.skipUnless(asynchronous.SUPPORTED, "async views need Django 3.1")
+    def test_vanilla_with_async(self):
+        from asgiref.sync import async_to_sync
+
+        for lazy in (False, True):
+            router = routers.SimpleRouter()
+            discover(router, only=[("tests.vanilla", {"async": True})], lazy=lazy)
+            klass = router.registry[0][1]
+            views = {
+                "list": klass.as_view({"get": "list", "post": "create"}),
+                "detail": klass.as_view({"get": "retrieve", "patch": "partial_update"}),
+            }
+            self.assertTrue(asyncio.iscoroutinefunction(views["list"]))
+
+            def call(name, method, url, data=None):
+                request = getattr(self.factory, method)(url, data, format="json")
+                force_authenticate(request, self.editor)
+                kwargs = {"pk": url.split("/")[-2]} if name == "detail" else {}
+                response = async_to_sync(views[name])(request, **kwargs)
+                response.render()
+                return response
+
+            # The output matches the synchronous viewset
+            for name, url in (
+                ("list", "/tests-vanilla/"),
+                ("detail", "/tests-vanilla/%s/" % self.vanilla.pk),
+            ):
+                response = call(name, "get", url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    json.loads(response.content.decode("utf-8")),
+                    self.client.get(url).json()
+                )
+            self.assertEqual(
+                call("detail", "get", "/tests-vanilla/0/").status_code, 404
+            )
+
+            response = call("list", "post", "/tests-vanilla/", {
+                "editable_field": "async",
+                "another_editable_field": "another_editable_field",
+                "foreign_field": "http://testserver/tests-foo/%s/" % self.foo.pk,
+                "many_field": ["http://testserver/tests-bar/%s/" % self.bar.pk],
+            })
+            self.assertEqual(response.status_code, 201)
+            obj = models.Vanilla.objects.get(editable_field="async")
+            self.assertEqual(list(obj.many_field.all()), [self.bar])
+
+            # Actions without an async version run in the thread pool
+            response = call(
+                "detail", "patch", "/tests-vanilla/%s/" % obj.pk,
+                {"another_editable_field": "patched"}
+            )
+            self.assertEqual(response.status_code, 200)
+            obj.refresh_from_db()
+            self.assertEqual(obj.another_editable_field, "patched")
+            obj.delete()
+
+            # Anonymous users are turned away before the handler runs
+            request = self.factory.get("/tests-vanilla/")
+            response = async_to_sync(views["list"])(request)
+            self.assertEqual(response.status_code, 403)
+
+    def test_vanilla_sparse_fields(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                "/tests-vanilla/?fields=url,editable_field"
+            )
+        self.assertEqual(
+            response.json()["results"][0],
+            {
+                u"url": u"http://testserver/tests-vanilla/1/",
+                u"editable_field": models.Vanilla.objects.get(pk=1).editable_field
+            }
+        )
+
+        # Only the requested columns are read and relations are not prefetched
+        self.assertEqual(len(context.captured_queries), 1)
+        self.failIf("another_editable_field" in context.captured_queries[0]["sql"])
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get("/tests-vanilla/?omit=many_field")
+        self.assertEqual(
+            sorted(response.json()["results"][0].keys()),
+            sorted(k for k in get_control().keys() if k != "many_field")
+        )
+        self.assertEqual(len(context.captured_queries), 1)
 
     def test_vanilla_get(self):
         response = self.client.get("/tests-vanilla/%s/" % self.vanilla.pk)
@@ -109,10 +737,355 @@ class ViewsTestCase(unittest.TestCase):
             "editable_field_x"
         )
 
+    def test_link_modes(self):
+        url = "/tests-vanilla/%s/" % self.vanilla.pk
+        response = self.client.get(url + "?links=path")
+        self.assertEqual(response.json()["url"], url)
+        self.assertEqual(
+            response.json()["foreign_field"], "/tests-foo/%s/" % self.foo.pk
+        )
+        response = self.client.get(url + "?links=pk")
+        self.assertEqual(response.json()["url"], self.vanilla.pk)
+        self.assertEqual(response.json()["many_field"], [self.bar.pk])
+
+        # Rows are rendered the same way
+        views = []
+        for options in ({}, {"fast_read": True}):
+            router = routers.SimpleRouter()
+            discover(router, only=[("tests.vanilla", options)])
+            views.append(router.registry[0][1].as_view({"get": "list"}))
+        for links in ("path", "pk"):
+            contents = []
+            for view in views:
+                request = self.factory.get("/tests-vanilla/?links=%s" % links)
+                force_authenticate(request, self.editor)
+                response = view(request)
+                response.render()
+                contents.append(response.content)
+            self.assertEqual(contents[0], contents[1])
+
+    def test_binary_renderers(self):
+
+        class PathRenderer(renderers.BinaryRenderer):
+            media_type = "application/x-drfe-test"
+            format = "drfe-test"
+            link_mode = "path"
+
+            def dumps(self, data):
+                return json.dumps(data, default=self.get_default()).encode("utf-8")
+
+        classes = (
+            JSONRenderer, renderers.MessagePackRenderer,
+            renderers.CBORRenderer, PathRenderer
+        )
+        router = routers.SimpleRouter()
+        with override_settings(
+            REST_FRAMEWORK_EXTRAS=dict(get_settings(), **{"renderer-classes": classes})
+        ):
+            discover(router, only=["tests.vanilla"])
+        klass = router.registry[0][1]
+        self.assertEqual(
+            klass.renderer_classes,
+            (JSONRenderer,) + tuple(
+                k for k in classes[1:] if k.is_available()
+            )
+        )
+        view = klass.as_view({"get": "retrieve"})
+
+        def get(accept, url="/tests-vanilla/%s/" % self.vanilla.pk):
+            request = self.factory.get(url, HTTP_ACCEPT=accept)
+            force_authenticate(request, self.editor)
+            response = view(request, pk=self.vanilla.pk)
+            response.render()
+            return response
+
+        expected = self.client.get("/tests-vanilla/%s/" % self.vanilla.pk).json()
+        response = get("application/x-drfe-test")
+        self.assertEqual(response["Content-Type"], "application/x-drfe-test")
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(data["url"], "/tests-vanilla/%s/" % self.vanilla.pk)
+
+        # The query parameter takes precedence over the renderer
+        response = get(
+            "application/x-drfe-test",
+            "/tests-vanilla/%s/?links=absolute" % self.vanilla.pk
+        )
+        self.assertEqual(json.loads(response.content.decode("utf-8")), expected)
+
+        if renderers.msgpack is not None:
+            response = get("application/msgpack")
+            self.assertEqual(
+                renderers.msgpack.unpackb(response.content, raw=False), expected
+            )
+        if renderers.cbor2 is not None:
+            response = get("application/cbor")
+            self.assertEqual(renderers.cbor2.loads(response.content), expected)
+
+    def test_hyperlink(self):
+        request = self.factory.get("/tests-vanilla/")
+        field = RelaxedHyperlinkedRelatedField(
+            view_name="foo-detail", read_only=True
+        )
+        field._context = {"request": request}
+        control = relations.HyperlinkedRelatedField(
+            view_name="foo-detail", read_only=True
+        )
+        control._context = {"request": request}
+        for value in (self.foo, relations.PKOnlyObject(pk=self.foo.pk)):
+            self.assertEqual(
+                field.to_representation(value),
+                control.to_representation(value)
+            )
+
+        field = RelaxedHyperlinkedRelatedField(
+            view_name="nothing-detail", read_only=True
+        )
+        field._context = {"request": request}
+        self.assertEqual(
+            field.to_representation(self.foo), "__not_implemented__"
+        )
+
+        # Routes the placeholder key does not match are reversed as usual
+        from django.urls import path
+
+        class UUIDUrls(object):
+            urlpatterns = [
+                path("things/<uuid:pk>/", lambda request, pk: None,
+                    name="thing-detail")
+            ]
+
+        value = relations.PKOnlyObject(pk=uuid.uuid4())
+        with override_settings(ROOT_URLCONF=UUIDUrls):
+            drfe_reverse.clear_url_templates()
+            for klass in (HyperlinkedRelatedField, RelaxedHyperlinkedRelatedField):
+                field = klass(view_name="thing-detail", read_only=True)
+                field._context = {"request": request}
+                self.assertEqual(
+                    field.to_representation(value),
+                    "http://testserver/things/%s/" % value.pk
+                )
+        drfe_reverse.clear_url_templates()
+
+    def test_url_template_cache(self):
+        self.client.get("/tests-vanilla/")
+        self.assertTrue(drfe_reverse._path_templates)
+
+        # Registration must clear the cache
+        register(routers.SimpleRouter())
+        self.assertFalse(drfe_reverse._path_templates)
+
+    def test_admin_form_class_cache(self):
+        serializer_klass = type(
+            str("WithAdminClassSerializer"),
+            (HyperlinkedModelSerializer,),
+            {
+                "model": models.WithAdminClass,
+                "admin": admin.ModelAdmin,
+                "admin_site": admin.site
+            }
+        )
+        request = self.factory.get("/")
+        request.user = self.editor
+        form_class = serializer_klass(context={"request": request}).form_class
+        self.assertTrue("editable_field" in form_class.base_fields)
+        self.assertTrue(
+            serializer_klass(context={"request": request}).form_class
+            is form_class
+        )
+
+        # A user with other permissions gets another form class
+        request.user = AnonymousUser()
+        self.failIf(
+            serializer_klass(context={"request": request}).form_class
+            is form_class
+        )
+
+        clear_form_class_cache()
+        request.user = self.editor
+        self.failIf(
+            serializer_klass(context={"request": request}).form_class
+            is form_class
+        )
+
+    def test_form_initial(self):
+        from django import forms as django_forms
+
+        class PlainForm(forms.WithFormForm):
+            editable_field = django_forms.CharField(initial="initial")
+
+        class InstanceForm(forms.WithFormForm):
+
+            def __init__(self, *args, **kwargs):
+                super(InstanceForm, self).__init__(*args, **kwargs)
+                self.fields["editable_field"].initial = "for-%s" % self.instance.pk
+
+        request = self.factory.get("/")
+
+        def get_initial(form, instance=None):
+            serializer_klass = type(
+                str("InitialSerializer"),
+                (HyperlinkedModelSerializer,),
+                {"model": models.WithForm, "form": form}
+            )
+            serializer = serializer_klass(instance, context={"request": request})
+            return serializer.get_initial()
+
+        # Declared initials are read once per form class without a form
+        self.assertEqual(get_initial(PlainForm), {"editable_field": "initial"})
+        self.assertEqual(
+            get_initial(PlainForm, self.with_form), {"editable_field": "initial"}
+        )
+        self.assertTrue(PlainForm in serializers_module._form_initials)
+
+        # Initials that __init__ derives from the instance don't leak. The
+        # second instance is not saved to keep the primary keys other tests
+        # expect.
+        other = models.WithForm(pk=self.with_form.pk + 1000, foreign_field=self.foo)
+        for instance in (self.with_form, other, None):
+            self.assertEqual(
+                get_initial(InstanceForm, instance),
+                {"editable_field": "for-%s" % getattr(instance, "pk", None)}
+            )
+        self.failIf(InstanceForm in serializers_module._form_initials)
+
+    def test_form_class_cache_eviction(self):
+        cache = FormClassCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+        # Row converter plans are not sized by form-cache-size
+        settings = dict(get_settings(), **{"form-cache-size": 1})
+        with override_settings(REST_FRAMEWORK_EXTRAS=settings):
+            self.assertEqual(
+                converters._plans.get_maxsize(), converters.PLAN_CACHE_SIZE
+            )
+
+    def test_field_map(self):
+        serializer_klass = type(
+            str("FieldMapSerializer"),
+            (HyperlinkedModelSerializer,),
+            {"model": models.Vanilla}
+        )
+        request = self.factory.get("/?fields=url,many_field")
+        first = serializer_klass(context={"request": request}).fields
+        field_map = serializer_klass._field_map
+        second = serializer_klass(context={"request": request}).fields
+        self.assertTrue(serializer_klass._field_map is field_map)
+        self.assertEqual(list(first.keys()), ["url", "many_field"])
+
+        # Every instance binds its own copies
+        self.failIf(first["url"] is second["url"])
+        self.failIf(
+            first["many_field"].child_relation
+            is second["many_field"].child_relation
+        )
+        self.assertTrue(first["url"].parent is not second["url"].parent)
+
+        # Instances without a request get all the fields
+        self.assertEqual(
+            list(serializer_klass().fields.keys()), list(field_map.keys())
+        )
+
+    def test_instrumentation(self):
+        sink = instrumentation.MemorySink()
+        instrumentation.set_sink(sink)
+        try:
+            discover(routers.SimpleRouter(), only=["tests.bar"])
+            self.client.get("/tests-withform/")
+            self.client.patch(
+                "/tests-withform/%s/" % self.with_form.pk,
+                {"another_editable_field": self.with_form.another_editable_field}
+            )
+            data = sink.get()
+        finally:
+            instrumentation.reset()
+
+        names = set(name for name, labels in data.keys())
+        for name in (
+            "discover", "request", "queries", "hyperlink", "form_validate",
+            "form_save", "form_get_cached_form"
+        ):
+            self.assertTrue(name in names, name)
+        queries = data[("queries", (("view", "TestsWithFormViewSet"),))]
+        self.assertEqual(queries["count"], 2)
+        self.assertTrue(queries["total"] > 0)
+
+        # Nothing is measured when disabled
+        self.assertTrue(instrumentation.timer("request") is instrumentation._null_timer)
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            sink = instrumentation.PrometheusFileSink(path, interval=0)
+            sink.timing("request", 0.5, {"view": "V"})
+            sink.count("queries", 3, {"view": "V"})
+            with open(path) as fp:
+                self.assertEqual(fp.read(), "\n".join([
+                    'drfe_queries_total{view="V"} 3',
+                    'drfe_request_seconds_count{view="V"} 1',
+                    'drfe_request_seconds_sum{view="V"} 0.5',
+                ]) + "\n")
+        finally:
+            os.remove(path)
+
+        # Write errors never reach the caller
+        sink = instrumentation.PrometheusFileSink(
+            os.path.join(path, "missing", "drfe.prom"), interval=0
+        )
+        with self.assertLogs("django", "ERROR") as logs:
+            sink.count("queries", 1, {})
+        self.assertTrue("could not write metrics" in logs.output[0])
+        self.failIf(sink.flush_lock.locked())
+
+    def test_permission_set(self):
+        user = get_user_model().objects.create(username="permission_set")
+        group = Group.objects.create(name="permission_set")
+        group.permissions.add(Permission.objects.get(codename="change_vanilla"))
+        user.groups.add(group)
+        permission = DjangoModelPermissions()
+
+        class View(object):
+            queryset = models.Vanilla.objects.all()
+
+        def check(method="put"):
+            request = Request(getattr(self.factory, method)("/"))
+            request.user = get_user_model().objects.get(pk=user.pk)
+            with CaptureQueriesContext(connection) as context:
+                result = [
+                    permission.has_permission(request, View())
+                    for i in range(3)
+                ]
+            return result[0], len(context.captured_queries)
+
+        settings = dict(get_settings(), **{"permission-cache": True})
+        try:
+            self.assertEqual(check(), (True, 2))
+            self.assertEqual(check("delete"), (False, 2))
+
+            with override_settings(REST_FRAMEWORK_EXTRAS=settings):
+                self.assertEqual(check(), (True, 2))
+                self.assertEqual(check(), (True, 0))
+
+                # Changing memberships invalidates the cached permissions
+                user.groups.remove(group)
+                self.assertEqual(check(), (False, 2))
+                user.groups.add(group)
+                self.assertEqual(check(), (True, 2))
+                group.permissions.clear()
+                self.assertEqual(check(), (False, 2))
+        finally:
+            user.delete()
+            group.delete()
+
     def test_with_form_list(self):
         response = self.client.get("/tests-withform/")
         as_json = response.json()
-        self.assertEqual(as_json[0], get_control(model="withform"))
+        self.assertEqual(as_json["results"][0], get_control(model="withform"))
 
     def test_with_form_get(self):
         response = self.client.get("/tests-withform/%s/" % self.with_form.pk)
@@ -147,10 +1120,133 @@ class ViewsTestCase(unittest.TestCase):
             "editable_field_x"
         )
 
+    def test_with_form_patch_partial(self):
+        before = models.WithForm.objects.get(pk=self.with_form.pk)
+        data = {
+            "another_editable_field": "another_editable_field_x",
+        }
+        response = self.client.patch(
+            "/tests-withform/%s/" % self.with_form.pk,
+            data,
+        )
+        self.assertEqual(response.status_code, 200)
+        after = models.WithForm.objects.get(pk=self.with_form.pk)
+        self.assertEqual(
+            after.another_editable_field, "another_editable_field_x"
+        )
+        self.assertEqual(after.editable_field, before.editable_field)
+        self.assertEqual(after.foreign_field, before.foreign_field)
+        self.assertEqual(
+            list(after.many_field.all()), list(before.many_field.all())
+        )
+
+        # The form class may not be changed by a partial update
+        self.failIf(hasattr(forms.WithFormForm.Meta, "exclude"))
+        self.assertEqual(len(forms.WithFormForm.base_fields), 4)
+
+        after.another_editable_field = before.another_editable_field
+        after.save()
+
+    def test_with_timestamp_conditional(self):
+        router = routers.SimpleRouter()
+        discover(router, only=[("tests.withtimestamp", {"conditional": True})])
+        klass = router.registry[0][1]
+        self.assertEqual(klass.timestamp_field, "updated")
+        list_view = klass.as_view({"get": "list"})
+        detail_view = klass.as_view({"get": "retrieve"})
+        obj = models.WithTimestamp.objects.create(editable_field="a")
+
+        def get(view, headers=None, **kwargs):
+            request = self.factory.get(
+                "/tests-withtimestamp/", **(headers or {})
+            )
+            force_authenticate(request, self.editor)
+            with CaptureQueriesContext(connection) as context:
+                response = view(request, **kwargs)
+            return response, len(context.captured_queries)
+
+        try:
+            for view, kwargs in ((list_view, {}), (detail_view, {"pk": obj.pk})):
+                response, n = get(view, **kwargs)
+                self.assertEqual(response.status_code, 200)
+                etag = response["ETag"]
+                self.assertEqual(
+                    response.has_header("Last-Modified"), view is detail_view
+                )
+
+                # Answered without serializing
+                response, n = get(view, {"HTTP_IF_NONE_MATCH": etag}, **kwargs)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(n, 1)
+                self.assertEqual(response["ETag"], etag)
+
+                obj.editable_field += "a"
+                obj.save()
+                response, n = get(view, {"HTTP_IF_NONE_MATCH": etag}, **kwargs)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response["ETag"], etag)
+
+            # Deletes change the list's ETag but not its latest timestamp
+            other = models.WithTimestamp.objects.create(editable_field="b")
+            etag = get(list_view)[0]["ETag"]
+            since = http_date(time.time() + 60)
+            other.delete()
+            response, n = get(list_view, {"HTTP_IF_MODIFIED_SINCE": since})
+            self.assertEqual(response.status_code, 200)
+            response, n = get(list_view, {"HTTP_IF_NONE_MATCH": etag})
+            self.assertEqual(response.status_code, 200)
+
+            # By default only objects are fingerprinted, so plain list
+            # requests run no aggregate
+            router = routers.SimpleRouter()
+            discover(router, only=["tests.withtimestamp"])
+            klass = router.registry[0][1]
+            response, n = get(klass.as_view({"get": "list"}))
+            self.assertEqual(response.status_code, 200)
+            self.failIf(response.has_header("ETag"))
+            response, n = get(klass.as_view({"get": "retrieve"}), pk=obj.pk)
+            self.assertTrue(response.has_header("ETag"))
+        finally:
+            obj.delete()
+
+        # Only date and time fields are timestamps
+        self.assertEqual(
+            drfe_get_timestamp_field(models.WithTimestamp, "updated"), "updated"
+        )
+        for name in ("editable_field", "id", "missing"):
+            self.assertEqual(
+                drfe_get_timestamp_field(models.WithTimestamp, name), None
+            )
+
+        # Models without a timestamp field only support it for lists on request
+        router = routers.SimpleRouter()
+        discover(router, only=[
+            "tests.bar", ("tests.foo", {"conditional": True})
+        ])
+        klasses = dict((r[0], r[1]) for r in router.registry)
+        self.failIf(hasattr(klasses["tests-bar"], "timestamp_field"))
+        response, n = get(klasses["tests-foo"].as_view({"get": "list"}))
+        etag = response["ETag"]
+        self.failIf(response.has_header("Last-Modified"))
+        response, n = get(
+            klasses["tests-foo"].as_view({"get": "list"}),
+            {"HTTP_IF_NONE_MATCH": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+        response, n = get(
+            klasses["tests-foo"].as_view({"get": "retrieve"}),
+            {"HTTP_IF_NONE_MATCH": etag},
+            pk=self.foo.pk
+        )
+        self.assertEqual(response.status_code, 200)
+        self.failIf(response.has_header("ETag"))
+
     def test_with_tricky_form_list(self):
         response = self.client.get("/tests-withtrickyform/")
         as_json = response.json()
-        self.assertEqual(as_json[0], get_control(model="withtrickyform"))
+        self.assertEqual(
+            as_json["results"][0], get_control(model="withtrickyform")
+        )
 
     def test_with_tricky_form_create(self):
         """We cannot handle declared form fields yet"""
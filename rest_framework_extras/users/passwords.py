@@ -0,0 +1,44 @@
+"""Password hashing for the user serializers. Hashing is started when a
+password is validated and, with the offload option of the password-hashing
+setting, runs in the thread pool of the async-pool setting, so passwords of a
+list of users are hashed in parallel while the list is validated. Hashing is
+timed as password_hash by the instrumentation sink."""
+
+from django.contrib.auth.hashers import make_password
+
+from rest_framework_extras import asynchronous, instrumentation
+
+
+def get_options():
+    # Import late to avoid a circular import
+    from rest_framework_extras import get_settings
+    return get_settings().get("password-hashing", None) or {}
+
+
+@instrumentation.timed("password_hash")
+def hash_password(raw):
+    return make_password(raw)
+
+
+class Password(object):
+    """A password that is being hashed. raw is the password as given and get
+    returns the hash."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.future = None
+        self.hashed = None
+        if get_options().get("offload", False):
+            self.future = asynchronous.get_executor().submit(
+                hash_password, raw
+            )
+
+    def get(self):
+        if self.hashed is None:
+            # A hash still waiting for a thread is made here, since the pool
+            # may be busy with the request that waits for it
+            if (self.future is not None) and not self.future.cancel():
+                self.hashed = self.future.result()
+            else:
+                self.hashed = hash_password(self.raw)
+        return self.hashed
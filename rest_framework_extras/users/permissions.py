@@ -1,4 +1,4 @@
-from rest_framework.permissions import DjangoObjectPermissions
+from rest_framework_extras.permissions import DjangoObjectPermissions
 
 
 class UserPermissions(DjangoObjectPermissions):
@@ -6,13 +6,19 @@ class UserPermissions(DjangoObjectPermissions):
     def has_permission(self, request, view):
         # Grant seemingly powerful permissions. has_object_permission will
         # refine it further.
-        return view.action in ("retrieve", "update", "partial_update") \
-            or request.user.is_staff
+        user = request.user
+        if user.is_staff:
+            return True
+        if view.action not in ("retrieve", "update", "partial_update"):
+            return False
+
+        # The queryset of other users holds only their own row. Refuse other
+        # rows here so they get a 403 instead of a 404.
+        lookup = view.kwargs.get(view.lookup_url_kwarg or view.lookup_field)
+        return user.is_authenticated and (str(lookup) == str(user.pk))
 
     def has_object_permission(self, request, view, obj):
         user = request.user
-        #if user.username == "user":
-        #    import pdb;pdb.set_trace()
 
         if user.is_superuser:
             return True
@@ -1,65 +1,68 @@
-from django.contrib.auth import get_user_model
+from django.contrib.auth import get_user_model, password_validation
 
 from rest_framework import serializers
 from rest_framework import fields
 
+from rest_framework_extras import instrumentation
+from rest_framework_extras.serializers import HyperlinkedIdentityField, \
+    HyperlinkedRelatedField
+from rest_framework_extras.users.passwords import Password
 
-class UserSerializerForSuperUser(serializers.HyperlinkedModelSerializer):
-    password = fields.CharField(allow_blank=True, write_only=True)
 
-    class Meta:
-        model = get_user_model()
-        fields = "__all__"
-        write_only_fields = ("password",)
+class PasswordMixin(object):
+    """Hashes the password before the user is written so that creating or
+    updating a user is a single write. Hashing starts during validation."""
+
+    def validate_password(self, value):
+        return Password(value)
 
     def create(self, validated_data):
         password = validated_data.pop("password", None)
-        user = super(UserSerializerForSuperUser, self).create(validated_data)
         if password is not None:
-            user.set_password(password)
-            user.save()
+            validated_data["password"] = password.get()
+        with instrumentation.timer("user_write"):
+            user = super(PasswordMixin, self).create(validated_data)
+        if password is not None:
+            # Saving after set_password notifies the validators
+            password_validation.password_changed(password.raw, user)
         return user
 
     def update(self, instance, validated_data):
         password = validated_data.pop("password", None)
-        user = super(UserSerializerForSuperUser, self).update(
-            instance, validated_data
-        )
-        if password:
-            user.set_password(password)
-            user.save()
-        return user
+        if (password is not None) and password.raw:
+            # Equivalent to set_password with the hash made in advance
+            instance.password = password.get()
+            instance._password = password.raw
+        with instrumentation.timer("user_write"):
+            return super(PasswordMixin, self).update(instance, validated_data)
 
 
-class UserSerializerForStaff(serializers.HyperlinkedModelSerializer):
+class UserSerializerForSuperUser(PasswordMixin, serializers.HyperlinkedModelSerializer):
+    serializer_related_field = HyperlinkedRelatedField
+    serializer_url_field = HyperlinkedIdentityField
     password = fields.CharField(allow_blank=True, write_only=True)
 
     class Meta:
         model = get_user_model()
-        fields = ("username", "first_name", "last_name", "email", "is_staff", "password")
-        read_only_fields = ("last_login", "date_joined", "is_active", "is_superuser")
+        fields = "__all__"
         write_only_fields = ("password",)
 
-    def create(self, validated_data):
-        password = validated_data.pop("password", None)
-        user = super(UserSerializerForStaff, self).create(validated_data)
-        if password is not None:
-            user.set_password(password)
-            user.save()
-        return user
 
-    def update(self, instance, validated_data):
-        password = validated_data.pop("password", None)
-        user = super(UserSerializerForStaff, self).update(
-            instance, validated_data
-        )
-        if password:
-            user.set_password(password)
-            user.save()
-        return user
+class UserSerializerForStaff(PasswordMixin, serializers.HyperlinkedModelSerializer):
+    serializer_related_field = HyperlinkedRelatedField
+    serializer_url_field = HyperlinkedIdentityField
+    password = fields.CharField(allow_blank=True, write_only=True)
+
+    class Meta:
+        model = get_user_model()
+        fields = ("username", "first_name", "last_name", "email", "is_staff", "password")
+        read_only_fields = ("last_login", "date_joined", "is_active", "is_superuser")
+        write_only_fields = ("password",)
 
 
-class UserSerializerForUser(serializers.HyperlinkedModelSerializer):
+class UserSerializerForUser(PasswordMixin, serializers.HyperlinkedModelSerializer):
+    serializer_related_field = HyperlinkedRelatedField
+    serializer_url_field = HyperlinkedIdentityField
     password = fields.CharField(allow_blank=True, write_only=True)
 
     class Meta:
@@ -67,13 +70,3 @@ class UserSerializerForUser(serializers.HyperlinkedModelSerializer):
         fields = ("username", "first_name", "last_name", "email", "password")
         read_only_fields = ("last_login", "date_joined", "is_active")
         write_only_fields = ("password",)
-
-    def update(self, instance, validated_data):
-        password = validated_data.pop("password", None)
-        user = super(UserSerializerForUser, self).update(
-            instance, validated_data
-        )
-        if password:
-            user.set_password(password)
-            user.save()
-        return user
@@ -2,16 +2,93 @@ from django.contrib.auth import get_user_model
 
 from rest_framework import viewsets
 from rest_framework.authentication import SessionAuthentication, BasicAuthentication
+from rest_framework_extras.querysets import get_related_lookups
 from rest_framework_extras.users.permissions import UserPermissions
 from rest_framework_extras.users.serializers import UserSerializerForSuperUser, \
     UserSerializerForStaff, UserSerializerForUser
 
 
+# Column names and related lookups per serializer class
+_columns = {}
+_lookups = {}
+
+
+def get_columns(serializer_class, model):
+    """Return the names of the concrete fields serializer_class renders"""
+
+    try:
+        return _columns[serializer_class]
+    except KeyError:
+        pass
+    names = set([model._meta.pk.name])
+    concrete = dict(
+        (f.name, f) for f in model._meta.concrete_fields
+    )
+    for field in serializer_class().fields.values():
+        if field.write_only or not field.source_attrs:
+            continue
+        if field.source_attrs[0] in concrete:
+            names.add(field.source_attrs[0])
+    result = tuple(sorted(names))
+    _columns[serializer_class] = result
+    return result
+
+
+def get_lookups(serializer_class, model):
+    """Return the related lookups for the relations serializer_class
+    renders"""
+
+    try:
+        return _lookups[serializer_class]
+    except KeyError:
+        pass
+    result = get_related_lookups(model, serializer_class)
+    _lookups[serializer_class] = result
+    return result
+
+
 class UsersViewSet(viewsets.ModelViewSet):
+    """Regular users only see their own row. Staff see all users, users
+    other than superusers or only themselves depending on the
+    staff-user-visibility setting. Only the columns the serializer for the
+    role renders are loaded, and the relations it renders are read with one
+    query each."""
+
     queryset = get_user_model().objects.all()
     authentication_classes = (SessionAuthentication, BasicAuthentication)
     permission_classes = (UserPermissions,)
 
+    def get_staff_visibility(self):
+        # Import late to avoid a circular import
+        from rest_framework_extras import get_settings
+        return get_settings().get("staff-user-visibility", "all")
+
+    def get_queryset(self):
+        queryset = super(UsersViewSet, self).get_queryset()
+        user = self.request.user
+        if not user.is_superuser:
+            if not user.is_staff:
+                queryset = queryset.filter(pk=user.pk) \
+                    if user.is_authenticated else queryset.none()
+            else:
+                visibility = self.get_staff_visibility()
+                if visibility == "non-superusers":
+                    queryset = queryset.exclude(is_superuser=True)
+                elif visibility == "self":
+                    queryset = queryset.filter(pk=user.pk)
+        serializer_class = self.get_serializer_class()
+        select_related, prefetch_related = get_lookups(
+            serializer_class, queryset.model
+        )
+        queryset = queryset.only(
+            *get_columns(serializer_class, queryset.model)
+        )
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
     def get_serializer_class(self):
         user = self.request.user
         if user.is_superuser:
@@ -0,0 +1,684 @@
+import hashlib
+import logging
+import threading
+from calendar import timegm
+
+import six
+from six.moves.urllib.parse import urlparse
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connections, transaction
+from django.db.models import Count, Max, prefetch_related_objects
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.urls import Resolver404, get_script_prefix, resolve
+from django.views.decorators.csrf import csrf_exempt
+
+from rest_framework import permissions, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from rest_framework_extras import cache, instrumentation
+from rest_framework_extras.converters import get_row_converter
+from rest_framework_extras.querysets import count_queries, \
+    get_lazy_fields, split_many_to_many
+from rest_framework_extras.serializers import get_sparse_fields
+
+
+logger = logging.getLogger("django")
+
+
+class ModelViewSet(viewsets.ModelViewSet):
+    """Base class for the viewsets generated by discover. The related lookups
+    are applied on every request so list endpoints run a fixed number of
+    queries.
+
+    When the fields or omit query parameters narrow the serializer, columns
+    and relations that are not rendered are not loaded either.
+
+    If streaming is set the list endpoint renders JSON in chunks of
+    chunk_size objects without pagination, so memory use does not grow with
+    the number of rows.
+
+    If fast_read is set the list endpoint reads rows with values() and
+    renders them with a row converter instead of the serializer. The output
+    is the same. Serializers with fields a converter can't render use the
+    regular path.
+
+    If query_guard is set the list endpoint counts the queries run while
+    serializing and logs the fields that run a query per object."""
+
+    select_related = ()
+    prefetch_related = ()
+    streaming = False
+    chunk_size = 2000
+    fast_read = False
+    query_guard = False
+
+    def get_ordering_fields(self):
+        """Return the names of the fields the paginator orders by"""
+
+        ordering = getattr(self.paginator, "ordering", None) or ()
+        if isinstance(ordering, six.string_types):
+            ordering = (ordering,)
+        return set(o.lstrip("-") for o in ordering)
+
+    def get_queryset(self):
+        queryset = super(ModelViewSet, self).get_queryset()
+        select_related = self.select_related
+        prefetch_related = self.prefetch_related
+
+        fields, omit = get_sparse_fields(getattr(self, "request", None))
+        if (fields is not None) or omit:
+
+            def wanted(lookup):
+                name = getattr(lookup, "prefetch_through", lookup)
+                name = name.split("__")[0]
+                return ((fields is None) or (name in fields)) \
+                    and (name not in (omit or ()))
+
+            select_related = [l for l in select_related if wanted(l)]
+            prefetch_related = [l for l in prefetch_related if wanted(l)]
+
+            # Keep the columns pagination orders by
+            keep = set([queryset.model._meta.pk.name])
+            keep.update(self.get_ordering_fields())
+            queryset = queryset.only(*[
+                f.name for f in queryset.model._meta.concrete_fields
+                if wanted(f.name) or (f.name in keep) or (f.attname in keep)
+            ])
+
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+    def dispatch(self, request, *args, **kwargs):
+        if not instrumentation.is_enabled():
+            return super(ModelViewSet, self).dispatch(request, *args, **kwargs)
+
+        # Time the request and count its queries. Queries run while a
+        # streamed response is consumed are not counted.
+        name = self.__class__.__name__
+        with count_queries() as counter:
+            with instrumentation.timer("request", view=name):
+                response = super(ModelViewSet, self).dispatch(
+                    request, *args, **kwargs
+                )
+        instrumentation.count("queries", counter.count, view=name)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if isinstance(request.accepted_renderer, JSONRenderer):
+            if self.streaming:
+                queryset = self.filter_queryset(self.get_queryset())
+                return StreamingHttpResponse(
+                    self.stream_list(queryset, request.accepted_renderer),
+                    content_type=request.accepted_renderer.media_type
+                )
+            if self.fast_read:
+                response = self.fast_list(request)
+                if response is not None:
+                    return response
+        if self.query_guard:
+            return self.guarded_list(request)
+        return super(ModelViewSet, self).list(request, *args, **kwargs)
+
+    def guarded_list(self, request):
+        """Render the list like ModelViewSet.list and log the fields that run
+        a query per object while being serialized."""
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        instances = list(queryset) if page is None else page
+        with count_queries() as counter:
+            data = self.get_serializer(instances, many=True).data
+        if counter.count and (len(instances) > 1):
+            self.log_lazy_fields(queryset, instances)
+
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    def log_lazy_fields(self, queryset, instances):
+        # The rendered instances hold the related objects loaded on the way,
+        # so the fields are checked against fresh copies
+        fresh = list(queryset.filter(pk__in=[i.pk for i in instances]))
+        for name, queries in get_lazy_fields(self.get_serializer(), fresh):
+            if queries >= len(fresh):
+                logger.warning(
+                    "DRFE: %s.%s runs %s queries for %s objects in %s. Add it "
+                    "to select_related or prefetch_related." % (
+                        queryset.model._meta.label, name, queries,
+                        len(fresh), self.__class__.__name__
+                    )
+                )
+
+    def fast_list(self, request):
+        """Render the list from values() rows. Return None if the serializer
+        can't be rendered by a row converter."""
+
+        converter = get_row_converter(self.get_serializer())
+        if converter is None:
+            return None
+
+        # Cursor pagination reads the ordering fields from the rows
+        columns = converter.columns | self.get_ordering_fields()
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = queryset.prefetch_related(None).values(*columns)
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(converter.convert(page))
+        return Response(converter.convert(rows))
+
+    def stream_list(self, queryset, renderer):
+        """Yield a JSON array one chunk of serialized objects at a time"""
+
+        # Iterators skip prefetching, so it is done per chunk instead
+        if not queryset.ordered:
+            queryset = queryset.order_by("pk")
+        iterator = queryset.prefetch_related(None).iterator(
+            chunk_size=self.chunk_size
+        )
+
+        yield b"["
+        first = True
+        chunk = []
+        for obj in iterator:
+            chunk.append(obj)
+            if len(chunk) == self.chunk_size:
+                yield self.render_chunk(chunk, renderer, first)
+                first = False
+                chunk = []
+        if chunk:
+            yield self.render_chunk(chunk, renderer, first)
+        yield b"]"
+
+    def render_chunk(self, chunk, renderer, first):
+        if self.prefetch_related:
+            prefetch_related_objects(chunk, *self.prefetch_related)
+        data = self.get_serializer(chunk, many=True).data
+
+        # Strip the enclosing brackets so chunks join into one array
+        content = renderer.render(data)[1:-1]
+        if first:
+            return content
+        return b"," + content
+
+
+class BulkMixin(object):
+    """Adds a bulk route to a model viewset. POST creates, PUT and PATCH
+update and DELETE deletes a list of items. Items to update or delete are
+identified by pk or url. Every item is validated before anything is written,
+all writes happen in one transaction and errors are reported per item in a
+list that matches the payload."""
+
+    @action(detail=False, methods=["post", "put", "patch", "delete"])
+    def bulk(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return Response(
+                {"non_field_errors": ["Expected a list of items."]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        method = request.method.lower()
+        if method == "post":
+            return self.bulk_create(request.data)
+        if method == "delete":
+            return self.bulk_destroy(request.data)
+        return self.bulk_update(request.data, partial=(method == "patch"))
+
+    def get_bulk_pk(self, item):
+        """Return the primary key for a pk, url or dictionary containing one
+        of them."""
+
+        if isinstance(item, dict):
+            if "pk" in item:
+                return item["pk"]
+            item = item.get("url", None)
+
+        if isinstance(item, six.string_types) and ("/" in item):
+            path = urlparse(item).path
+            prefix = get_script_prefix()
+            if path.startswith(prefix):
+                path = "/" + path[len(prefix):]
+            try:
+                match = resolve(path)
+            except Resolver404:
+                return None
+            return match.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+
+        return item
+
+    def get_bulk_pks(self, model, data):
+        """Return a tuple of (pks, errors) for the items of data. The pk of an
+        item that does not name a valid primary key is None and its error
+        says why."""
+
+        pks = []
+        errors = []
+        for item in data:
+            pk = self.get_bulk_pk(item)
+            if pk is not None:
+                try:
+                    pk = model._meta.pk.to_python(pk)
+                except (DjangoValidationError, TypeError, ValueError):
+                    pks.append(None)
+                    errors.append({"non_field_errors": ["Invalid pk."]})
+                    continue
+            pks.append(pk)
+            errors.append(
+                {} if pk is not None else {"non_field_errors": ["Not found."]}
+            )
+        return pks, errors
+
+    def split_many_to_many(self, model, validated_data):
+        return split_many_to_many(model, validated_data)
+
+    def is_form_backed(self, serializer):
+        return getattr(serializer, "form_class", None) is not None
+
+    def bulk_create(self, data):
+        serializers = [self.get_serializer(data=item) for item in data]
+        errors = [{} if s.is_valid() else s.errors for s in serializers]
+        if any(errors):
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        model = self.get_queryset().model
+        features = connections[model._default_manager.db].features
+        can_return = getattr(
+            features, "can_return_rows_from_bulk_insert",
+            getattr(features, "can_return_ids_from_bulk_insert", False)
+        )
+
+        with transaction.atomic():
+            # Forms may do work in save, and without returned keys the
+            # objects can't be linked to, so those are saved one by one.
+            # Returned keys need PostgreSQL, or SQLite 3.35 with Django 4.0.
+            if not can_return \
+                or any(self.is_form_backed(s) for s in serializers):
+                instances = [s.save() for s in serializers]
+            else:
+                instances = []
+                many_to_many = []
+                for serializer in serializers:
+                    validated_data = dict(serializer.validated_data)
+                    many_to_many.append(
+                        self.split_many_to_many(model, validated_data)
+                    )
+                    instances.append(model(**validated_data))
+                model._default_manager.bulk_create(instances)
+                self.bulk_set_many_to_many(model, instances, many_to_many)
+                self.bump_cache(model)
+
+        if self.prefetch_related:
+            prefetch_related_objects(instances, *self.prefetch_related)
+        serializer = self.get_serializer(instances, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def bump_cache(self, model):
+        """Invalidate cached responses after a bulk write. bulk_create and
+        bulk_update send no signals, and neither do the inserted through
+        rows."""
+
+        cache.bump(model)
+        for field in model._meta.many_to_many:
+            cache.bump(field.remote_field.through)
+
+    def bulk_set_many_to_many(self, model, instances, many_to_many):
+        """Insert the rows for the many to many relations of newly created
+        instances with one query per relation."""
+
+        rows = {}
+        for instance, di in zip(instances, many_to_many):
+            for field_name, values in di.items():
+                field = model._meta.get_field(field_name)
+                through = field.remote_field.through
+                rows.setdefault(through, []).extend([
+                    through(**{
+                        field.m2m_field_name(): instance,
+                        field.m2m_reverse_field_name(): value
+                    }) for value in values
+                ])
+        for through, objs in rows.items():
+            through._default_manager.bulk_create(objs)
+
+    def bulk_update(self, data, partial=False):
+        queryset = self.filter_queryset(self.get_queryset())
+        pks, pk_errors = self.get_bulk_pks(queryset.model, data)
+        found = queryset.in_bulk([pk for pk in pks if pk is not None])
+        found = dict((str(k), v) for k, v in found.items())
+
+        serializers = []
+        errors = []
+        for pk, pk_error, item in zip(pks, pk_errors, data):
+            if pk_error:
+                serializers.append(None)
+                errors.append(pk_error)
+                continue
+            instance = found.get(str(pk), None)
+            if instance is None:
+                serializers.append(None)
+                errors.append({"non_field_errors": ["Not found."]})
+                continue
+            self.check_object_permissions(self.request, instance)
+            serializer = self.get_serializer(
+                instance, data=item, partial=partial
+            )
+            serializers.append(serializer)
+            errors.append({} if serializer.is_valid() else serializer.errors)
+        if any(errors):
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        model = queryset.model
+        bulk = hasattr(model._default_manager, "bulk_update")
+        with transaction.atomic():
+            if not bulk or any(self.is_form_backed(s) for s in serializers):
+                instances = [s.save() for s in serializers]
+            else:
+                instances = []
+                fields = set()
+                for serializer in serializers:
+                    instance = serializer.instance
+                    validated_data = dict(serializer.validated_data)
+                    many_to_many = self.split_many_to_many(
+                        model, validated_data
+                    )
+                    for attr, value in validated_data.items():
+                        setattr(instance, attr, value)
+                        fields.add(attr)
+                    for field_name, values in many_to_many.items():
+                        getattr(instance, field_name).set(values)
+                    instances.append(instance)
+
+                # bulk_update does not call pre_save
+                for field in model._meta.concrete_fields:
+                    if getattr(field, "auto_now", False):
+                        for instance in instances:
+                            field.pre_save(instance, False)
+                        fields.add(field.name)
+
+                if fields:
+                    model._default_manager.bulk_update(
+                        instances, list(fields)
+                    )
+                self.bump_cache(model)
+
+        serializer = self.get_serializer(instances, many=True)
+        return Response(serializer.data)
+
+    def bulk_destroy(self, data):
+        queryset = self.filter_queryset(self.get_queryset())
+        pks, errors = self.get_bulk_pks(queryset.model, data)
+        queryset = queryset.filter(
+            pk__in=[pk for pk in pks if pk is not None]
+        ).prefetch_related(None)
+        instances = list(queryset)
+        found = set(str(instance.pk) for instance in instances)
+        errors = [
+            error or (
+                {} if str(pk) in found else {"non_field_errors": ["Not found."]}
+            ) for pk, error in zip(pks, errors)
+        ]
+        if any(errors):
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # Like destroy, which checks through get_object
+        for instance in instances:
+            self.check_object_permissions(self.request, instance)
+        with transaction.atomic():
+            queryset.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ConditionalMixin(object):
+    """Answers conditional GET requests with 304 Not Modified before anything
+is serialized. Objects are fingerprinted by timestamp_field, a field that
+changes whenever an object is saved. If conditional_lists is set lists are
+fingerprinted by their count, largest primary key and latest timestamp, which
+costs an aggregate over the filtered table on every list request. Without a
+timestamp field only lists get an ETag and changes to existing objects go
+unnoticed. Changes to related objects are never detected."""
+
+    timestamp_field = None
+    conditional_lists = False
+
+    def get_etag(self, request, fingerprint):
+        """Make an ETag that varies by the fingerprint, the URL, the media type
+        and the user."""
+
+        parts = [
+            fingerprint,
+            request.get_full_path(),
+            getattr(request, "accepted_media_type", None),
+            getattr(request, "version", None),
+            getattr(getattr(request, "user", None), "pk", None)
+        ]
+        digest = hashlib.md5(
+            ":".join(str(part) for part in parts).encode("utf-8")
+        ).hexdigest()
+        return quote_etag(digest)
+
+    def get_conditional(self, request, fingerprint, last_modified):
+        """Return a tuple of (headers, response). The response is None if the
+        request has to be answered in full."""
+
+        headers = {"ETag": self.get_etag(request, fingerprint)}
+        if last_modified is not None:
+            last_modified = timegm(last_modified.utctimetuple())
+            headers["Last-Modified"] = http_date(last_modified)
+        response = get_conditional_response(
+            request, etag=headers["ETag"], last_modified=last_modified
+        )
+        if response is not None:
+            for key, value in headers.items():
+                response[key] = value
+        return headers, response
+
+    def get_list_fingerprint(self, queryset):
+        """Return the fingerprint of a list, read with one query"""
+
+        aggregates = {"count": Count("pk"), "max_pk": Max("pk")}
+        if self.timestamp_field:
+            aggregates["last_modified"] = Max(self.timestamp_field)
+        result = queryset.order_by().aggregate(**aggregates)
+        return "%s:%s:%s" % (
+            result["count"], result["max_pk"], result.get("last_modified", None)
+        )
+
+    def list(self, request, *args, **kwargs):
+        if not self.conditional_lists:
+            return super(ConditionalMixin, self).list(request, *args, **kwargs)
+
+        # Deleting an object does not change the latest timestamp, so lists
+        # only get an ETag, which covers the count
+        queryset = self.filter_queryset(self.get_queryset())
+        headers, response = self.get_conditional(
+            request, self.get_list_fingerprint(queryset), None
+        )
+        if response is not None:
+            return response
+        response = super(ConditionalMixin, self).list(request, *args, **kwargs)
+        for key, value in headers.items():
+            response[key] = value
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.timestamp_field:
+            return super(ConditionalMixin, self).retrieve(
+                request, *args, **kwargs
+            )
+
+        instance = self.get_object()
+        last_modified = getattr(instance, self.timestamp_field)
+        headers, response = self.get_conditional(
+            request, "%s:%s" % (instance.pk, last_modified), last_modified
+        )
+        if response is not None:
+            return response
+        serializer = self.get_serializer(instance)
+        response = Response(serializer.data)
+        for key, value in headers.items():
+            response[key] = value
+        return response
+
+
+class CacheMixin(object):
+    """Serves list and detail responses from the Django cache. Permissions are
+checked before the cache is read. Entries are keyed by URL, query parameters,
+version, media type and the kind of caller, and expire when the model or the
+models in cache_models change. Detail responses are not cached if a
+permission class checks objects, and HTML responses or responses that vary by
+user are never cached.
+
+cache_options may contain timeout, max_entries and alias, the name of the
+Django cache to use."""
+
+    cache_options = {}
+    cache_models = ()
+
+    def get_cache_alias(self):
+        return self.cache_options.get("alias", "default")
+
+    def get_caller_class(self, request):
+        user = getattr(request, "user", None)
+        if (user is None) or not user.is_authenticated:
+            return "anonymous"
+        if user.is_superuser:
+            return "superuser"
+        if user.is_staff:
+            return "staff"
+        return "user"
+
+    def get_cache_key(self, request):
+        model = self.queryset.model
+        generations = cache.get_generations(
+            (model,) + tuple(self.cache_models), self.get_cache_alias()
+        )
+        parts = [
+            request.build_absolute_uri(request.path),
+            getattr(self, "action", None),
+            sorted(request.query_params.lists()),
+            getattr(request, "version", None),
+            getattr(request, "accepted_media_type", None),
+            [klass.__name__ for klass in self.permission_classes],
+            self.get_caller_class(request),
+            generations
+        ]
+        return cache.get_response_key(cache.get_model_label(model), parts)
+
+    def checks_objects(self):
+        base = permissions.BasePermission.has_object_permission
+        return any(
+            getattr(type(permission), "has_object_permission", base) is not base
+            for permission in self.get_permissions()
+        )
+
+    def get_cached(self, request, handler, *args, **kwargs):
+        key = self.get_cache_key(request)
+        hit = cache.get_response(key, self.get_cache_alias())
+        if hit is not None:
+            status_code, content_type, content = hit
+            return HttpResponse(
+                content, status=status_code, content_type=content_type
+            )
+        self.cache_key = key
+        return handler(request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached(
+            request, super(CacheMixin, self).list, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        if self.checks_objects():
+            return super(CacheMixin, self).retrieve(request, *args, **kwargs)
+        return self.get_cached(
+            request, super(CacheMixin, self).retrieve, *args, **kwargs
+        )
+
+    def is_cacheable(self, response):
+        """Responses are keyed by the kind of caller, not the user, so pages
+        that may show the user or a CSRF token, and responses that vary by
+        user, are not cached"""
+
+        renderer = getattr(response, "accepted_renderer", None)
+        if (renderer is None) or renderer.media_type.startswith("text/html"):
+            return False
+        vary = [
+            header.strip().lower()
+            for header in response.get("Vary", "").split(",")
+        ]
+        return ("cookie" not in vary) and ("authorization" not in vary)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(CacheMixin, self).finalize_response(
+            request, response, *args, **kwargs
+        )
+        key = getattr(self, "cache_key", None)
+        if (key is None) or (response.status_code != 200) \
+            or response.streaming or not self.is_cacheable(response):
+            return response
+
+        response.render()
+        cache.set_response(
+            cache.get_model_label(self.queryset.model),
+            key,
+            (response.status_code, response["Content-Type"], response.content),
+            timeout=self.cache_options.get("timeout", 300),
+            max_entries=self.cache_options.get("max_entries", None),
+            alias=self.get_cache_alias()
+        )
+        return response
+
+
+class LazyViewSet(viewsets.ModelViewSet):
+    """Placeholder registered by discover in lazy mode. The real viewset class
+    is built by factory when the first request arrives and kept for the life
+    of the process. Mixins that add extra actions are also bases of the
+    placeholder so the router creates their routes."""
+
+    factory = None
+    is_async = False
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_viewset_class(cls):
+        klass = cls.__dict__.get("viewset_class", None)
+        if klass is None:
+            with cls._lock:
+                klass = cls.__dict__.get("viewset_class", None)
+                if klass is None:
+                    klass = cls.factory()
+                    cls.viewset_class = klass
+        return klass
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        views = []
+
+        def get_view():
+            if not views:
+                views.append(
+                    cls.get_viewset_class().as_view(actions, **initkwargs)
+                )
+            return views[0]
+
+        if cls.is_async:
+            async def view(request, *args, **kwargs):
+                return await get_view()(request, *args, **kwargs)
+            view.csrf_exempt = True
+        else:
+            def view(request, *args, **kwargs):
+                return get_view()(request, *args, **kwargs)
+            view = csrf_exempt(view)
+
+        # Routers and schema generators inspect these
+        view.cls = cls
+        view.initkwargs = initkwargs
+        view.actions = actions
+        return view